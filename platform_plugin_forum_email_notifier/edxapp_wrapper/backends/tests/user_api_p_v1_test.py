@@ -3,3 +3,4 @@ User API module definitions for Open edX Palm release.
 """
 
 get_user_preference = object
+UserPreference = object
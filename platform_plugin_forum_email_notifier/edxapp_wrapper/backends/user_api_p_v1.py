@@ -4,4 +4,5 @@ User API module definitions for Open edX Palm release.
 
 # pylint: disable=import-error, unused-import
 
+from openedx.core.djangoapps.user_api.models import UserPreference
 from openedx.core.djangoapps.user_api.preferences.api import get_user_preference
@@ -15,3 +15,13 @@ def get_user_preference(*args, **kwargs):
     backend = import_module(backend_function)
 
     return backend.get_user_preference(*args, **kwargs)
+
+
+def get_user_preference_model():
+    """
+    Wrapper for `UserPreference` model in edx-platform.
+    """
+    backend_function = settings.FORUM_NOTIFIER_USER_API_BACKEND
+    backend = import_module(backend_function)
+
+    return backend.UserPreference
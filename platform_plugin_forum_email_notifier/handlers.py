@@ -1,4 +1,9 @@
 """Signal handlers for forum events."""
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from openedx_events.learning.signals import (
     FORUM_RESPONSE_COMMENT_CREATED,
@@ -6,8 +11,9 @@ from openedx_events.learning.signals import (
     FORUM_THREAD_RESPONSE_CREATED,
 )
 
+from platform_plugin_forum_email_notifier.models import ForumNotificationPreference
 from platform_plugin_forum_email_notifier.tasks import notify_users
-from platform_plugin_forum_email_notifier.utils import ForumObject, get_base_email_context
+from platform_plugin_forum_email_notifier.utils import ForumObject, get_task_buffer, invalidate_course_preferences
 
 
 @receiver(FORUM_THREAD_CREATED)
@@ -17,7 +23,7 @@ def forum_thread_created_handler(
     """
     Handle the FORUM_THREAD_CREATED event.
     """
-    notify_users.delay(
+    _notify_users(
         thread.id,
         thread.discussion,
         thread.course_id,
@@ -28,7 +34,6 @@ def forum_thread_created_handler(
         thread.user.pii.username,
         thread.user.pii.email,
         object_type=ForumObject.THREAD,
-        context=get_base_email_context(),
     )
 
 
@@ -39,7 +44,7 @@ def forum_response_created_handler(
     """
     Handle the FORUM_THREAD_RESPONSE_CREATED event.
     """
-    notify_users.delay(
+    _notify_users(
         thread.id,
         thread.discussion,
         thread.course_id,
@@ -50,7 +55,6 @@ def forum_response_created_handler(
         thread.user.pii.username,
         thread.user.pii.email,
         object_type=ForumObject.RESPONSE,
-        context=get_base_email_context(),
     )
 
 
@@ -61,7 +65,7 @@ def forum_comment_created_handler(
     """
     Handle the FORUM_RESPONSE_COMMENT_CREATED event.
     """
-    notify_users.delay(
+    _notify_users(
         thread.id,
         thread.discussion,
         thread.course_id,
@@ -72,5 +76,35 @@ def forum_comment_created_handler(
         thread.user.pii.username,
         thread.user.pii.email,
         object_type=ForumObject.COMMENT,
-        context=get_base_email_context(),
     )
+
+
+def _notify_users(*args, **kwargs):
+    """
+    Enqueue the `notify_users` task for a forum update.
+
+    When `FORUM_NOTIFIER_DEFER_NOTIFICATIONS` is enabled, the task is added to the
+    task buffer once the transaction is committed, so the request never waits for
+    the broker nor fails because of it.
+    """
+    if getattr(settings, "FORUM_NOTIFIER_DEFER_NOTIFICATIONS", False):
+        transaction.on_commit(partial(get_task_buffer().put, notify_users, *args, **kwargs))
+    else:
+        notify_users.delay(*args, **kwargs)
+
+
+@receiver(post_save, sender=ForumNotificationPreference)
+@receiver(post_delete, sender=ForumNotificationPreference)
+def forum_preference_changed_handler(
+    sender, instance, **kwargs
+):  # pylint: disable=unused-argument
+    """
+    Invalidate the cached preferences of the course when a preference changes.
+
+    The cache is invalidated once the transaction is committed, so readers
+    see the change as soon as it is visible. A reader that queried the
+    preferences before the commit caches them under the previous version,
+    which is no longer read.
+    """
+    course_id = instance.course_id
+    transaction.on_commit(lambda: invalidate_course_preferences(course_id))
@@ -1,23 +1,42 @@
 """Forum digest command to trigger the digestion of forum activity."""
 import logging
-from datetime import timedelta
+from argparse import ArgumentTypeError
 from enum import Enum
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Value
 from django.utils import timezone
 
-from platform_plugin_forum_email_notifier.models import ForumNotificationDigest, PreferenceOptions
-from platform_plugin_forum_email_notifier.tasks import send_digest
-from platform_plugin_forum_email_notifier.utils import get_base_email_context
+from platform_plugin_forum_email_notifier.models import DIGEST_INTERVALS, ForumNotificationDigest, PreferenceOptions
+from platform_plugin_forum_email_notifier.tasks import send_digest, send_digest_batch
+from platform_plugin_forum_email_notifier.utils import chunked, delete_orphan_events, get_base_email_context
 
 log = logging.getLogger(__name__)
 
+DIGESTS_CHUNK_SIZE = 2000
+
 
 class DigestType(Enum):
     DAILY = "daily"
     WEEKLY = "weekly"
 
 
+def parse_shard(value):
+    """
+    Parse a shard given as `index/count`, e.g. `0/4`.
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError as error:
+        raise ArgumentTypeError("The shard must be given as INDEX/COUNT, e.g. 0/4") from error
+
+    if count < 1 or not 0 <= index < count:
+        raise ArgumentTypeError("The shard index must be between 0 and COUNT - 1")
+
+    return index, count
+
+
 class Command(BaseCommand):
     """
     Generates a digest of forum activity.
@@ -29,12 +48,21 @@ class Command(BaseCommand):
             type=DigestType,
             help="the digest type to generate",
         )
+        parser.add_argument(
+            "--shard",
+            type=parse_shard,
+            help=(
+                "only generate the digests of the users whose id modulo COUNT is INDEX, "
+                "given as INDEX/COUNT, e.g. 0/4"
+            ),
+        )
 
     def handle(self, *args, **options):
         """
         Trigger the digestion of forum activity.
         """
         digest = options["digest"]
+        shard_index, shard_count = options.get("shard") or (0, 1)
 
         if not digest:
             raise CommandError("You must specify a digest type")
@@ -46,32 +74,67 @@ class Command(BaseCommand):
             self._generate_digest(
                 PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
                 digest,
-                interval=timedelta(days=1),
+                interval=DIGEST_INTERVALS[PreferenceOptions.ALL_POSTS_DAILY_DIGEST],
+                shard=(shard_index, shard_count),
             )
         elif digest == DigestType.WEEKLY:
             self._generate_digest(
                 PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
                 digest,
-                interval=timedelta(days=7),
+                interval=DIGEST_INTERVALS[PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST],
+                shard=(shard_index, shard_count),
             )
 
-    def _generate_digest(self, filter_type, display_name, interval):
+        # The orphan events are shared by every shard, so they are deleted once
+        if shard_index == 0:
+            delete_orphan_events()
+
+    def _generate_digest(self, filter_type, display_name, interval, shard=(0, 1)):
         """
         Generate a digest for a given filter_type.
+
+        When the digests are sharded, only the digests of the users whose id
+        modulo the shard count is the shard index are generated. Every digest
+        belongs to exactly one shard.
         """
-        log.info(f"Generating {display_name} digest")
-        already_digested = ForumNotificationDigest.objects.filter(
-            digest_type=filter_type, last_sent__lte=timezone.now() - interval
-        ).exclude(threads_json="[]")
-        never_digested = ForumNotificationDigest.objects.filter(
-            digest_type=filter_type, last_sent__isnull=True
-        ).exclude(threads_json="[]")
+        shard_index, shard_count = shard
+        log.info(f"Generating {display_name} digest for shard {shard_index}/{shard_count}")
+        # A single range condition on the (digest_type, has_pending, last_sent)
+        # index. The digests never sent have `last_sent` in the past. The flag is
+        # compared with a value, since a bare boolean column doesn't match the index.
+        digests = ForumNotificationDigest.objects.filter(
+            digest_type=filter_type,
+            has_pending=Value(True),
+            last_sent__lte=timezone.now() - interval,
+        )
+
+        if shard_count > 1:
+            digests = digests.annotate(shard=F("user_id") % shard_count).filter(
+                shard=shard_index
+            )
+
+        # The digests are streamed from the database without the default ordering,
+        # so memory use doesn't depend on the number of digests
+        digests = (
+            digests.values_list("id", "user_id", "course_id")
+            .order_by()
+            .iterator(chunk_size=DIGESTS_CHUNK_SIZE)
+        )
+        context = get_base_email_context()
+        batch_size = getattr(settings, "FORUM_NOTIFIER_DIGEST_BATCH_SIZE", 0)
+
+        if batch_size:
+            for batch in chunked(digests, batch_size):
+                log.info(f"Generating {display_name} digest for {len(batch)} users")
 
-        digests = already_digested | never_digested
+                send_digest_batch.delay(
+                    [digest_id for digest_id, _, _ in batch], context=context
+                )
+            return
 
-        for digest in digests:
+        for digest_id, user_id, course_id in digests:
             log.info(
-                f"Generating {display_name} digest for user {digest.user.id} in course {digest.course_id}"
+                f"Generating {display_name} digest for user {user_id} in course {course_id}"
             )
 
-            send_digest.delay(digest.id, context=get_base_email_context())
+            send_digest.delay(digest_id, context=context)
@@ -0,0 +1,123 @@
+"""Forum digest scheduler command to send the digests when they are due."""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Value
+from django.utils import timezone
+
+from platform_plugin_forum_email_notifier.models import ForumNotificationDigest
+from platform_plugin_forum_email_notifier.tasks import send_digest_batch
+from platform_plugin_forum_email_notifier.utils import delete_orphan_events, get_base_email_context
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Sends the digests of forum activity when they are due.
+
+    Every digest is due one digest interval after it was last sent, so the
+    digests are spread along the day instead of being sent at once. The forum
+    events already sent in every digest are deleted periodically.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="the number of digests sent per task",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=60,
+            help="the seconds to wait when no digest is due",
+        )
+        parser.add_argument(
+            "--orphan-events-interval",
+            type=float,
+            default=3600,
+            help="the seconds between deletions of the forum events already sent in every digest",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="send the digests due now and exit",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Send the due digests in batches until stopped.
+
+        A failed iteration is logged and retried after the poll interval, so
+        the scheduler survives database or broker outages. With `--once` the
+        failure to schedule the digests is raised instead.
+        """
+        orphan_events_deleted_at = None
+
+        while True:
+            # The connections broken or expired while waiting are replaced
+            close_old_connections()
+
+            if (
+                orphan_events_deleted_at is None
+                or time.monotonic() - orphan_events_deleted_at >= options["orphan_events_interval"]
+            ):
+                orphan_events_deleted_at = time.monotonic()
+                try:
+                    delete_orphan_events()
+                except Exception:  # pylint: disable=broad-except
+                    log.exception("Failed to delete the orphan forum events")
+
+            try:
+                scheduled = self._schedule_due_digests(options["batch_size"])
+            except Exception:  # pylint: disable=broad-except
+                if options["once"]:
+                    raise
+                log.exception("Failed to schedule the due digests")
+                scheduled = 0
+
+            if options["once"] and not scheduled:
+                return
+
+            if not scheduled:
+                time.sleep(options["poll_interval"])
+
+    def _schedule_due_digests(self, batch_size):
+        """
+        Enqueue a batch of the due digests.
+
+        The enqueued digests are postponed by the lease timeout, so they are not
+        picked again while they are waiting to be sent. The task schedules the
+        next digest once sent, and a digest not sent is retried afterwards.
+
+        Returns:
+            int: The number of enqueued digests.
+        """
+        now = timezone.now()
+        # The flag is compared with a value, so the query matches the index
+        digest_ids = list(
+            ForumNotificationDigest.objects.filter(
+                has_pending=Value(True), next_due_at__lte=now
+            )
+            .order_by("next_due_at")
+            .values_list("id", flat=True)[:batch_size]
+        )
+
+        if not digest_ids:
+            return 0
+
+        lease_timeout = getattr(settings, "FORUM_NOTIFIER_DIGEST_LEASE_TIMEOUT", 900)
+        ForumNotificationDigest.objects.filter(id__in=digest_ids).update(
+            next_due_at=now + timedelta(seconds=lease_timeout)
+        )
+
+        log.info(f"Scheduling {len(digest_ids)} due digests")
+        send_digest_batch.delay(digest_ids, context=get_base_email_context())
+
+        return len(digest_ids)
@@ -0,0 +1,120 @@
+# Generated by Django 4.0.10 on 2026-10-18 10:49
+
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+def threads_json_to_entries(apps, schema_editor):
+    """Move the items of every digest threads_json into digest entries."""
+    ForumNotificationDigest = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigest"
+    )
+    ForumNotificationDigestEntry = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigestEntry"
+    )
+
+    digests = (
+        ForumNotificationDigest.objects.exclude(threads_json="[]")
+        .values_list("id", "threads_json")
+        .iterator()
+    )
+    for digest_id, threads_json in digests:
+        ForumNotificationDigestEntry.objects.bulk_create(
+            [
+                ForumNotificationDigestEntry(
+                    digest_id=digest_id, item_json=json.dumps(item)
+                )
+                for item in json.loads(threads_json or "[]")
+            ]
+        )
+
+
+def entries_to_threads_json(apps, schema_editor):
+    """Rebuild the threads_json of every digest from its digest entries."""
+    ForumNotificationDigest = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigest"
+    )
+    ForumNotificationDigestEntry = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigestEntry"
+    )
+
+    threads = {}
+    entries = (
+        ForumNotificationDigestEntry.objects.order_by("id")
+        .values_list("digest_id", "item_json")
+        .iterator()
+    )
+    for digest_id, item_json in entries:
+        threads.setdefault(digest_id, []).append(json.loads(item_json))
+
+    ForumNotificationDigest.objects.update(threads_json="[]")
+    for digest_id, digest_threads in threads.items():
+        ForumNotificationDigest.objects.filter(id=digest_id).update(
+            threads_json=json.dumps(digest_threads)
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("platform_plugin_forum_email_notifier", "0003_forumnotificationdigest_last_sent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ForumNotificationDigestEntry",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="created",
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="modified",
+                    ),
+                ),
+                ("item_json", models.TextField()),
+                (
+                    "digest",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="entries",
+                        to="platform_plugin_forum_email_notifier.forumnotificationdigest",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+            },
+        ),
+        migrations.RunPython(threads_json_to_entries, entries_to_threads_json),
+        # The default lets the field be added back to existing digests on rollback
+        migrations.AlterField(
+            model_name="forumnotificationdigest",
+            name="threads_json",
+            field=models.TextField(default="[]"),
+        ),
+        migrations.RemoveField(
+            model_name="forumnotificationdigest",
+            name="threads_json",
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.0.10 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+import opaque_keys.edx.django.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("platform_plugin_forum_email_notifier", "0004_forumnotificationdigestentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ForumNotificationEvent",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="created",
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="modified",
+                    ),
+                ),
+                ("thread_id", models.CharField(max_length=255)),
+                (
+                    "course_id",
+                    opaque_keys.edx.django.models.CourseKeyField(
+                        db_index=True, max_length=255
+                    ),
+                ),
+                ("discussion", models.JSONField(blank=True, null=True)),
+                ("body", models.TextField()),
+                ("title", models.TextField(blank=True, null=True)),
+                ("url", models.CharField(max_length=255)),
+                ("author_id", models.CharField(max_length=255)),
+                ("author_username", models.CharField(max_length=255)),
+                ("author_email", models.CharField(max_length=255)),
+                ("object_type", models.IntegerField()),
+            ],
+            options={
+                "ordering": ["-created"],
+            },
+        ),
+        migrations.AddField(
+            model_name="forumnotificationdigestentry",
+            name="event",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="digest_entries",
+                to="platform_plugin_forum_email_notifier.forumnotificationevent",
+            ),
+        ),
+        # The default lets the field be added back to existing entries on rollback
+        migrations.AlterField(
+            model_name="forumnotificationdigestentry",
+            name="item_json",
+            field=models.TextField(default="{}"),
+        ),
+    ]
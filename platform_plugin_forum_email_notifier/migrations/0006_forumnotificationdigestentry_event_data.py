@@ -0,0 +1,86 @@
+# Generated by Django 4.0.10 on 2026-10-18 11:21
+
+from collections import defaultdict
+import hashlib
+import json
+
+from django.db import migrations
+
+# Entries linked to an event with each UPDATE
+UPDATE_BATCH_SIZE = 1000
+
+
+def entries_to_events(apps, schema_editor):
+    """Create one event per distinct digest item and link the entries to it."""
+    ForumNotificationDigestEntry = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigestEntry"
+    )
+    ForumNotificationEvent = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationEvent"
+    )
+
+    # Items are deduplicated by their hash, so their json is not kept in memory
+    events = {}
+    entry_ids = defaultdict(list)
+    entries = ForumNotificationDigestEntry.objects.values_list(
+        "id", "digest__course_id", "item_json"
+    ).iterator()
+    for entry_id, course_id, item_json in entries:
+        item_key = (course_id, hashlib.sha256(item_json.encode()).digest())
+        event_id = events.get(item_key)
+        if event_id is None:
+            item = json.loads(item_json)
+            event_id = ForumNotificationEvent.objects.create(
+                thread_id=item.get("thread_id") or "",
+                course_id=course_id,
+                discussion=item.get("discussion"),
+                body=item.get("body") or "",
+                title=item.get("title"),
+                url=item.get("url") or "",
+                author_id=item.get("author_id") or "",
+                author_username=item.get("author_username") or "",
+                author_email=item.get("author_email") or "",
+                object_type=item.get("object_type") or 0,
+            ).id
+            events[item_key] = event_id
+        entry_ids[event_id].append(entry_id)
+
+    for event_id, ids in entry_ids.items():
+        for start in range(0, len(ids), UPDATE_BATCH_SIZE):
+            ForumNotificationDigestEntry.objects.filter(
+                id__in=ids[start : start + UPDATE_BATCH_SIZE]
+            ).update(event_id=event_id)
+
+
+def events_to_entries(apps, schema_editor):
+    """Copy the event referenced by each digest entry back into the entry."""
+    ForumNotificationDigestEntry = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigestEntry"
+    )
+
+    for entry in ForumNotificationDigestEntry.objects.select_related("event").iterator():
+        event = entry.event
+        entry.item_json = json.dumps(
+            {
+                "thread_id": event.thread_id,
+                "discussion": event.discussion,
+                "body": event.body,
+                "title": event.title,
+                "url": event.url,
+                "author_id": event.author_id,
+                "author_username": event.author_username,
+                "author_email": event.author_email,
+                "object_type": event.object_type,
+            }
+        )
+        entry.save(update_fields=["item_json"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("platform_plugin_forum_email_notifier", "0005_forumnotificationevent"),
+    ]
+
+    operations = [
+        migrations.RunPython(entries_to_events, events_to_entries),
+    ]
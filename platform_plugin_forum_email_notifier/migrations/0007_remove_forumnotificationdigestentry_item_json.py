@@ -0,0 +1,29 @@
+# Generated by Django 4.0.10 on 2026-10-18 11:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "platform_plugin_forum_email_notifier",
+            "0006_forumnotificationdigestentry_event_data",
+        ),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="forumnotificationdigestentry",
+            name="item_json",
+        ),
+        migrations.AlterField(
+            model_name="forumnotificationdigestentry",
+            name="event",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="digest_entries",
+                to="platform_plugin_forum_email_notifier.forumnotificationevent",
+            ),
+        ),
+    ]
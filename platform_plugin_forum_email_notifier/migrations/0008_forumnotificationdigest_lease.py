@@ -0,0 +1,25 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "platform_plugin_forum_email_notifier",
+            "0007_remove_forumnotificationdigestentry_item_json",
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forumnotificationdigest",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="forumnotificationdigest",
+            name="lease_token",
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:40
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def set_has_pending(apps, schema_editor):
+    """
+    Flag the digests with pending entries.
+    """
+    ForumNotificationDigest = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigest"
+    )
+    ForumNotificationDigestEntry = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigestEntry"
+    )
+    ForumNotificationDigest.objects.filter(
+        Exists(ForumNotificationDigestEntry.objects.filter(digest=OuterRef("pk")))
+    ).update(has_pending=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("platform_plugin_forum_email_notifier", "0008_forumnotificationdigest_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forumnotificationdigest",
+            name="has_pending",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(set_has_pending, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="forumnotificationdigest",
+            index=models.Index(
+                fields=["digest_type", "has_pending", "last_sent"],
+                name="forum_digest_pending_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+import platform_plugin_forum_email_notifier.models
+
+
+def set_never_sent(apps, schema_editor):
+    """
+    Set the `last_sent` of the digests never sent to the sentinel value.
+    """
+    ForumNotificationDigest = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigest"
+    )
+    ForumNotificationDigest.objects.filter(last_sent__isnull=True).update(
+        last_sent=platform_plugin_forum_email_notifier.models.digest_never_sent()
+    )
+
+
+def unset_never_sent(apps, schema_editor):
+    """
+    Set the `last_sent` of the digests never sent back to null.
+    """
+    ForumNotificationDigest = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigest"
+    )
+    ForumNotificationDigest.objects.filter(
+        last_sent=platform_plugin_forum_email_notifier.models.digest_never_sent()
+    ).update(last_sent=None)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("platform_plugin_forum_email_notifier", "0009_forumnotificationdigest_has_pending"),
+    ]
+
+    operations = [
+        migrations.RunPython(set_never_sent, unset_never_sent),
+        migrations.AlterField(
+            model_name="forumnotificationdigest",
+            name="last_sent",
+            field=models.DateTimeField(
+                default=platform_plugin_forum_email_notifier.models.digest_never_sent
+            ),
+        ),
+    ]
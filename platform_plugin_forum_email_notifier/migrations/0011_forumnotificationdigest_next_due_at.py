@@ -0,0 +1,52 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:45
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+import platform_plugin_forum_email_notifier.models
+
+DIGEST_INTERVALS = {
+    4: timedelta(days=1),
+    5: timedelta(days=7),
+}
+
+
+def set_next_due_at(apps, schema_editor):
+    """
+    Schedule every digest one digest interval after it was last sent.
+    """
+    ForumNotificationDigest = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationDigest"
+    )
+    for digest_type, interval in DIGEST_INTERVALS.items():
+        ForumNotificationDigest.objects.filter(digest_type=digest_type).update(
+            next_due_at=F("last_sent") + interval
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "platform_plugin_forum_email_notifier",
+            "0010_forumnotificationdigest_last_sent_never_sent",
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forumnotificationdigest",
+            name="next_due_at",
+            field=models.DateTimeField(
+                default=platform_plugin_forum_email_notifier.models.digest_never_sent
+            ),
+        ),
+        migrations.RunPython(set_next_due_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="forumnotificationdigest",
+            index=models.Index(
+                fields=["has_pending", "next_due_at"], name="forum_digest_due_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.0.10 on 2026-10-18 14:30
+
+from bs4 import BeautifulSoup
+from django.db import migrations
+
+BATCH_SIZE = 1000
+# Maximum length of the simplified text, frozen so the migration doesn't depend
+# on the current code
+MAX_LENGTH = 160
+
+
+def get_simplified_text(text):
+    """
+    Return the text of a html string, truncated to MAX_LENGTH characters.
+    """
+    text = BeautifulSoup(text, "html.parser").get_text()
+
+    if len(text) <= MAX_LENGTH:
+        return text
+
+    return f"{text[:MAX_LENGTH]}..."
+
+
+def simplify_bodies(apps, schema_editor):
+    """
+    Store the simplified text of the body of the pending forum updates.
+    """
+    ForumNotificationEvent = apps.get_model(
+        "platform_plugin_forum_email_notifier", "ForumNotificationEvent"
+    )
+    events = []
+
+    for event in ForumNotificationEvent.objects.only("id", "body").iterator(
+        chunk_size=BATCH_SIZE
+    ):
+        event.body = get_simplified_text(event.body)
+        events.append(event)
+
+        if len(events) == BATCH_SIZE:
+            ForumNotificationEvent.objects.bulk_update(events, ["body"])
+            events = []
+
+    ForumNotificationEvent.objects.bulk_update(events, ["body"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("platform_plugin_forum_email_notifier", "0011_forumnotificationdigest_next_due_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(simplify_bodies, migrations.RunPython.noop),
+    ]
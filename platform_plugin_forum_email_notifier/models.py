@@ -1,6 +1,9 @@
 """
 Database models for forum_email_notifier.
 """
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.utils.translation import gettext as _
@@ -10,6 +13,19 @@ from opaque_keys.edx.django.models import CourseKeyField
 User = get_user_model()
 
 
+def digest_never_sent():
+    """
+    Get the `last_sent` of the digests never sent.
+
+    A date in the past is used instead of null, so the digests due are selected
+    with a single range condition on the index.
+    """
+    if settings.USE_TZ:
+        return datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    return datetime(1970, 1, 1)
+
+
 class PreferenceOptions(models.IntegerChoices):
     """
     Options for forum email notification preferences.
@@ -22,6 +38,13 @@ class PreferenceOptions(models.IntegerChoices):
     ALL_POSTS_WEEKLY_DIGEST = 5, _("All posts. (Weekly digest)")
 
 
+# Time between two digests of each digest preference
+DIGEST_INTERVALS = {
+    PreferenceOptions.ALL_POSTS_DAILY_DIGEST: timedelta(days=1),
+    PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST: timedelta(days=7),
+}
+
+
 class ForumNotificationPreference(TimeStampedModel):
     """
     A model to store forum email notification preferences for a user.
@@ -57,19 +80,12 @@ class ForumNotificationDigest(TimeStampedModel):
     """
     A model to store forum email notification digests for a user.
 
-    threads_json is a json string of threads. It's used to store the forum updates
-    for the digest. The format is:
-    {
-    "thread_id": thread_id,
-    "discussion": discussion,
-    "body": body,
-    "title": title,
-    "url": url,
-    "author_id": author_id,
-    "author_username": author_username,
-    "author_email": author_email,
-    "object_type": object_type,
-    }
+    The forum updates pending to be sent in the digest are stored as
+    ForumNotificationDigestEntry rows, and `has_pending` tells whether there is
+    any, so due digests are selected through an index. The digest is due at
+    `next_due_at`, one digest interval after it was last sent. A worker claims
+    the digest with a lease before sending it, so it is sent by a single worker.
+    A lease not released, e.g. by a killed worker, expires at `lease_expires_at`.
 
     .. no_pii:
     """
@@ -80,14 +96,100 @@ class ForumNotificationDigest(TimeStampedModel):
         related_name="forum_notification_digests",
     )
     course_id = CourseKeyField(max_length=255, db_index=True)
-    """
-    """
-    threads_json = models.TextField()
     digest_type = models.IntegerField(choices=PreferenceOptions.choices)
-    last_sent = models.DateTimeField(null=True, blank=True)
+    last_sent = models.DateTimeField(default=digest_never_sent)
+    lease_token = models.UUIDField(null=True, blank=True, db_index=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    has_pending = models.BooleanField(default=False)
+    next_due_at = models.DateTimeField(default=digest_never_sent)
 
     class Meta:
         """Meta class for ForumNotificationDigest."""
 
         ordering = ["-created"]
         unique_together = ["user", "course_id"]
+        indexes = [
+            models.Index(
+                fields=["digest_type", "has_pending", "last_sent"],
+                name="forum_digest_pending_idx",
+            ),
+            models.Index(
+                fields=["has_pending", "next_due_at"],
+                name="forum_digest_due_idx",
+            ),
+        ]
+
+
+class ForumNotificationEvent(TimeStampedModel):
+    """
+    A model to store a forum update once, so digests can reference it.
+
+    The body is stored as the simplified text sent in the emails.
+
+    .. pii: Stores the username and email address of the author of the forum update.
+        The event is deleted once no digest entry references it.
+    .. pii_types: username, email_address
+    .. pii_retirement: retained
+    """
+
+    thread_id = models.CharField(max_length=255)
+    course_id = CourseKeyField(max_length=255, db_index=True)
+    discussion = models.JSONField(null=True, blank=True)
+    body = models.TextField()
+    title = models.TextField(null=True, blank=True)
+    url = models.CharField(max_length=255)
+    author_id = models.CharField(max_length=255)
+    author_username = models.CharField(max_length=255)
+    author_email = models.CharField(max_length=255)
+    object_type = models.IntegerField()
+
+    def __str__(self):
+        """
+        Get a string representation of this model instance.
+        """
+        return "<ForumNotificationEvent, ID: {}>".format(self.id)
+
+    def to_item(self) -> dict:
+        """
+        Return the forum update in the format used by the digest templates.
+        """
+        return {
+            "thread_id": self.thread_id,
+            "discussion": self.discussion,
+            "body": self.body,
+            "title": self.title,
+            "url": self.url,
+            "author_id": self.author_id,
+            "author_username": self.author_username,
+            "author_email": self.author_email,
+            "object_type": self.object_type,
+        }
+
+    class Meta:
+        """Meta class for ForumNotificationEvent."""
+
+        ordering = ["-created"]
+
+
+class ForumNotificationDigestEntry(TimeStampedModel):
+    """
+    A model to link a forum update pending to be sent to a digest.
+
+    .. no_pii:
+    """
+
+    digest = models.ForeignKey(
+        to=ForumNotificationDigest,
+        on_delete=models.CASCADE,
+        related_name="entries",
+    )
+    event = models.ForeignKey(
+        to=ForumNotificationEvent,
+        on_delete=models.CASCADE,
+        related_name="digest_entries",
+    )
+
+    class Meta:
+        """Meta class for ForumNotificationDigestEntry."""
+
+        ordering = ["id"]
@@ -85,3 +85,25 @@ def plugin_settings(settings):
     settings.FORUM_NOTIFIER_USER_API_BACKEND = (
         "platform_plugin_forum_email_notifier.edxapp_wrapper.backends.user_api_p_v1"
     )
+    # Number of subscribers notified per Celery task. 0 sends one task per subscriber.
+    settings.FORUM_NOTIFIER_NOTIFICATION_BATCH_SIZE = 0
+    # Store each forum update once and pass its id to the notification and digest tasks.
+    settings.FORUM_NOTIFIER_EVENT_REFERENCES = False
+    # Seconds each worker process keeps the base email context of a site.
+    settings.FORUM_NOTIFIER_BASE_CONTEXT_TIMEOUT = 300
+    # Enqueue notify_users from a background thread once the transaction is committed.
+    settings.FORUM_NOTIFIER_DEFER_NOTIFICATIONS = False
+    # Tasks each process keeps waiting to be enqueued. Tasks over it are dropped.
+    settings.FORUM_NOTIFIER_TASK_BUFFER_SIZE = 1000
+    # Seconds the preferences of a course are cached. They are invalidated on every change.
+    settings.FORUM_NOTIFIER_PREFERENCES_CACHE_TIMEOUT = 3600
+    # Threads used to fetch the pages of thread subscriptions. 1 fetches them sequentially.
+    settings.FORUM_NOTIFIER_SUBSCRIPTIONS_MAX_WORKERS = 1
+    # Seconds the subscribers of a thread are cached. 0 disables the cache.
+    settings.FORUM_NOTIFIER_SUBSCRIBERS_CACHE_TIMEOUT = 0
+    # Digests sent per Celery task by the forum_digest command. 0 sends one task per digest.
+    settings.FORUM_NOTIFIER_DIGEST_BATCH_SIZE = 0
+    # Seconds a worker holds the claim of a digest. Claims not released expire afterwards.
+    settings.FORUM_NOTIFIER_DIGEST_LEASE_TIMEOUT = 900
+    # Items shown per digest. Larger digests are compacted. 0 shows every item.
+    settings.FORUM_NOTIFIER_DIGEST_MAX_ITEMS = 100
@@ -1,10 +1,13 @@
 """Tasks for the platform_plugin_forum_email_notifier plugin."""
-import json
 import logging
+from datetime import timedelta
+from itertools import chain
+from uuid import uuid4
 
 from celery import shared_task
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Case, DateTimeField, Exists, F, OuterRef, Q, Value, When
 from django.utils import timezone
 from edx_ace.recipient import Recipient
 from edx_django_utils.monitoring import set_code_owner_attribute
@@ -14,15 +17,21 @@ from platform_plugin_forum_email_notifier.edxapp_wrapper.lang_pref import LANGUA
 from platform_plugin_forum_email_notifier.edxapp_wrapper.user_api import get_user_preference
 from platform_plugin_forum_email_notifier.email import send_digest_email_notification, send_forum_email_notification
 from platform_plugin_forum_email_notifier.models import (
+    DIGEST_INTERVALS,
     ForumNotificationDigest,
-    ForumNotificationPreference,
+    ForumNotificationDigestEntry,
+    ForumNotificationEvent,
     PreferenceOptions,
 )
 from platform_plugin_forum_email_notifier.utils import (
     ForumObject,
+    chunked,
+    compact_digest_entries,
+    get_course_preferences,
+    get_language_preferences,
+    get_memoized_base_email_context,
     get_simplified_text,
-    get_staff_subscribers,
-    get_subscribers,
+    iter_subscribers,
 )
 
 log = logging.getLogger(__name__)
@@ -30,6 +39,13 @@ celery_log = logging.getLogger("edx.celery.task")
 
 User = get_user_model()
 
+DIGEST_PREFERENCES = (
+    PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+    PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
+)
+EXCLUDED_PREFERENCES = (PreferenceOptions.NONE, *DIGEST_PREFERENCES)
+BULK_BATCH_SIZE = 1000
+
 
 @shared_task
 @set_code_owner_attribute
@@ -45,7 +61,7 @@ def send_email_notification(
     author_email,
     object_type,
     subscriber,
-    context,
+    context=None,
 ):
     """
     Send a email notification to a subscriber user for forum updates.
@@ -54,7 +70,7 @@ def send_email_notification(
         thread_id (str): The thread id.
         discussion (dict): The discussion dict.
         course_id (str): The course id.
-        body (str): The body of the post.
+        body (str): The simplified body of the post.
         title (str): The title of the post.
         url (str): The url of the post.
         author_id (str): The author id.
@@ -62,7 +78,8 @@ def send_email_notification(
         author_email (str): The author email.
         object_type (str): The forum object type.
         subscriber (id): The subscriber id.
-        context (dict): The context for the email.
+        context (dict, optional): The context for the email. Defaults to the base email
+            context, built by the worker.
     """
     try:
         user = User.objects.get(id=subscriber)
@@ -70,9 +87,196 @@ def send_email_notification(
         log.warning(f"User {subscriber} does not exist")
         return
 
+    if context is None:
+        context = get_memoized_base_email_context()
+
     course = get_course_overview_or_none(course_id)
 
     language_preference = get_user_preference(user, LANGUAGE_KEY)
+
+    _send_forum_email(
+        user,
+        course,
+        language_preference,
+        thread_id,
+        discussion,
+        course_id,
+        body,
+        title,
+        url,
+        author_id,
+        author_username,
+        author_email,
+        object_type,
+        context,
+    )
+
+
+@shared_task
+@set_code_owner_attribute
+def send_email_notification_batch(
+    thread_id,
+    discussion,
+    course_id,
+    body,
+    title,
+    url,
+    author_id,
+    author_username,
+    author_email,
+    object_type,
+    subscribers,
+    context=None,
+):
+    """
+    Send a email notification to a batch of subscriber users for forum updates.
+
+    The users, their language preferences and the course overview are loaded
+    once for the whole batch, so the number of queries does not depend on the
+    number of subscribers.
+
+    Arguments:
+        thread_id (str): The thread id.
+        discussion (dict): The discussion dict.
+        course_id (str): The course id.
+        body (str): The simplified body of the post.
+        title (str): The title of the post.
+        url (str): The url of the post.
+        author_id (str): The author id.
+        author_username (str): The author username.
+        author_email (str): The author email.
+        object_type (str): The forum object type.
+        subscribers (list): The subscriber ids.
+        context (dict, optional): The context for the email. Defaults to the base email
+            context, built by the worker.
+    """
+    users = User.objects.in_bulk(subscribers)
+
+    for subscriber in set(subscribers) - set(users):
+        log.warning(f"User {subscriber} does not exist")
+
+    if not users:
+        return
+
+    if context is None:
+        context = get_memoized_base_email_context()
+
+    course = get_course_overview_or_none(course_id)
+    language_preferences = get_language_preferences(users.keys())
+
+    for user in users.values():
+        # A failed email doesn't stop the rest of the batch
+        try:
+            _send_forum_email(
+                user,
+                course,
+                language_preferences.get(user.id),
+                thread_id,
+                discussion,
+                course_id,
+                body,
+                title,
+                url,
+                author_id,
+                author_username,
+                author_email,
+                object_type,
+                dict(context),
+            )
+        except Exception:  # pylint: disable=broad-except
+            log.exception(f"Failed to send the forum notification to user {user.id}")
+
+
+@shared_task
+@set_code_owner_attribute
+def send_event_notification(event_id, subscriber, context=None):
+    """
+    Send a email notification of a stored forum update to a subscriber user.
+
+    Arguments:
+        event_id (int): The id of the ForumNotificationEvent.
+        subscriber (id): The subscriber id.
+        context (dict, optional): The context for the email. Defaults to the base email
+            context, built by the worker.
+    """
+    event_args = _get_event_args(event_id)
+
+    if event_args is not None:
+        send_email_notification(subscriber=subscriber, context=context, **event_args)
+
+
+@shared_task
+@set_code_owner_attribute
+def send_event_notification_batch(event_id, subscribers, context=None):
+    """
+    Send a email notification of a stored forum update to a batch of subscriber users.
+
+    Arguments:
+        event_id (int): The id of the ForumNotificationEvent.
+        subscribers (list): The subscriber ids.
+        context (dict, optional): The context for the email. Defaults to the base email
+            context, built by the worker.
+    """
+    event_args = _get_event_args(event_id)
+
+    if event_args is not None:
+        send_email_notification_batch(subscribers=subscribers, context=context, **event_args)
+
+
+def _get_event_args(event_id):
+    """
+    Get the arguments of the notification tasks from a stored forum update.
+
+    Arguments:
+        event_id (int): The id of the ForumNotificationEvent.
+
+    Returns:
+        dict: The forum update arguments, or None if the event does not exist.
+    """
+    try:
+        event = ForumNotificationEvent.objects.get(id=event_id)
+    except ForumNotificationEvent.DoesNotExist:
+        log.warning(f"Forum event {event_id} does not exist")
+        return None
+
+    return {**event.to_item(), "course_id": str(event.course_id)}
+
+
+def _send_forum_email(
+    user,
+    course,
+    language,
+    thread_id,
+    discussion,
+    course_id,
+    body,
+    title,
+    url,
+    author_id,
+    author_username,
+    author_email,
+    object_type,
+    context,
+):
+    """
+    Render and send the forum email notification to a single user.
+
+    Arguments:
+        user (User): The recipient user.
+        course (CourseOverview): The course overview.
+        language (str): The language preference of the user.
+        thread_id (str): The thread id.
+        discussion (dict): The discussion dict.
+        course_id (str): The course id.
+        body (str): The simplified body of the post.
+        title (str): The title of the post.
+        url (str): The url of the post.
+        author_id (str): The author id.
+        author_username (str): The author username.
+        author_email (str): The author email.
+        object_type (str): The forum object type.
+        context (dict): The context for the email.
+    """
     post_id = thread_id if title else discussion.get("id")
 
     context.update(
@@ -82,7 +286,7 @@ def send_email_notification(
             "course_name": course.display_name,
             "thread_id": thread_id,
             "discussion": discussion,
-            "body": get_simplified_text(body),
+            "body": body,
             "title": title,
             "url": f"{url}discussions/{course_id}/posts/{post_id}",
             "author_id": author_id,
@@ -94,7 +298,7 @@ def send_email_notification(
 
     send_forum_email_notification(
         recipient=Recipient(user.id, user.email),
-        language=language_preference,
+        language=language,
         user_context=context,
     )
 
@@ -112,7 +316,7 @@ def notify_users(
     author_username,
     author_email,
     object_type,
-    context,
+    context=None,
 ):
     """
     Get the subscribers for a thread and notify them.
@@ -128,43 +332,42 @@ def notify_users(
         author_username (str): The author username.
         author_email (str): The author email.
         object_type (str): The forum object type.
-        context (dict): The context for the email.
+        context (dict, optional): The context for the email. Defaults to the base email
+            context, built by the worker.
     """
     if object_type == ForumObject.THREAD:
-        subscribers = get_subscribers(thread_id)
+        subscribers = iter_subscribers(thread_id)
     elif object_type in (ForumObject.RESPONSE, ForumObject.COMMENT):
-        subscribers = get_subscribers(discussion.get("id"))
+        subscribers = iter_subscribers(discussion.get("id"))
     else:
         raise ValueError(f"Invalid thread event type: {object_type}")
 
-    staff_subscribers = get_staff_subscribers(course_id)
-
-    subscribers = subscribers | staff_subscribers
-
-    for subscriber in subscribers:
-        if subscriber in staff_subscribers:
-            try:
-                user = User.objects.get(id=subscriber)
-                # Altough we are getting staff_subscribers whom have a preference of ALL_POSTS,
-                # they can already be a subscriber of the thread, so we need to check if they
-                # have a preference for the course
-                preference = ForumNotificationPreference.objects.get(
-                    user=user, course_id=course_id
-                )
-                if preference.preference in (
-                    PreferenceOptions.NONE,
-                    PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
-                    PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
-                ):
-                    continue
-            except User.DoesNotExist:
-                log.warning(f"User {subscriber} does not exist")
-                continue
-            except ForumNotificationPreference.DoesNotExist:
-                pass
-                # If the user does not have a preference and they already are a subscriber
-                # we should notify them
-        send_email_notification.delay(
+    # A single query resolves the preferences of every user in the course: users
+    # with ALL_POSTS are notified of every post, and users with NONE or a digest
+    # preference are never notified immediately, even if they follow the thread.
+    preferences = get_course_preferences(course_id)
+    staff_subscribers = {
+        user_id
+        for user_id, preference in preferences.items()
+        if preference == PreferenceOptions.ALL_POSTS
+    }
+    excluded_subscribers = {
+        user_id
+        for user_id, preference in preferences.items()
+        if preference in EXCLUDED_PREFERENCES
+    }
+
+    recipients = _iter_recipients(subscribers, staff_subscribers, excluded_subscribers)
+    # The body is parsed once here, so the notifications and digests don't parse it
+    # again for every recipient
+    body = get_simplified_text(body)
+
+    batch_size = getattr(settings, "FORUM_NOTIFIER_NOTIFICATION_BATCH_SIZE", 0)
+
+    if getattr(settings, "FORUM_NOTIFIER_EVENT_REFERENCES", False):
+        # The forum update is stored once and the tasks receive its id, so their
+        # payload doesn't grow with the size of the post
+        event = _create_event(
             thread_id,
             discussion,
             course_id,
@@ -175,9 +378,50 @@ def notify_users(
             author_username,
             author_email,
             object_type,
-            subscriber,
-            context,
         )
+        if batch_size:
+            for batch in chunked(recipients, batch_size):
+                send_event_notification_batch.delay(event.id, batch, context)
+        else:
+            for subscriber in recipients:
+                send_event_notification.delay(event.id, subscriber, context)
+
+        handle_event_digests.delay(event.id)
+        return
+
+    if batch_size:
+        # The thread payload is serialized once per batch instead of once per recipient
+        for batch in chunked(recipients, batch_size):
+            send_email_notification_batch.delay(
+                thread_id,
+                discussion,
+                course_id,
+                body,
+                title,
+                url,
+                author_id,
+                author_username,
+                author_email,
+                object_type,
+                batch,
+                context,
+            )
+    else:
+        for subscriber in recipients:
+            send_email_notification.delay(
+                thread_id,
+                discussion,
+                course_id,
+                body,
+                title,
+                url,
+                author_id,
+                author_username,
+                author_email,
+                object_type,
+                subscriber,
+                context,
+            )
 
     handle_digests.delay(
         thread_id,
@@ -193,6 +437,26 @@ def notify_users(
     )
 
 
+def _iter_recipients(subscribers, staff_subscribers, excluded_subscribers):
+    """
+    Yield the users to notify of a forum update, without duplicates.
+
+    Staff subscribers are yielded first, since they are already known, and then
+    the thread subscribers as they are received. Excluded users are skipped.
+
+    Arguments:
+        subscribers (iterable): The ids of the thread subscribers.
+        staff_subscribers (set): The ids of the users notified of all posts.
+        excluded_subscribers (set): The ids of the users never notified.
+    """
+    seen = set(excluded_subscribers)
+
+    for subscriber in chain(staff_subscribers, subscribers):
+        if subscriber not in seen:
+            seen.add(subscriber)
+            yield subscriber
+
+
 @shared_task
 @set_code_owner_attribute
 def handle_digests(
@@ -210,11 +474,16 @@ def handle_digests(
     """
     Get the digest subscribers for a thread and notify them.
 
+    The forum update is appended to the digest of every subscriber with a
+    constant number of queries, regardless of the number of subscribers.
+    Appends only insert rows, so concurrent tasks for the same course never
+    overwrite each other.
+
     Arguments:
         thread_id (str): The thread id.
         discussion (dict): The discussion dict.
         course_id (str): The course id.
-        body (str): The body of the post.
+        body (str): The simplified body of the post.
         title (str): The title of the post.
         url (str): The url of the post.
         author_id (str): The author id.
@@ -222,88 +491,457 @@ def handle_digests(
         author_email (str): The author email.
         object_type (str): The forum object type.
     """
-    digest_preferences = ForumNotificationPreference.objects.filter(
-        preference__in=(
-            PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
-            PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
-        ),
+    digest_preferences = _get_digest_preferences(course_id)
+
+    if not digest_preferences:
+        return
+
+    # The forum update is stored once and referenced by the entry of every digest
+    event = _create_event(
+        thread_id,
+        discussion,
+        course_id,
+        body,
+        title,
+        url,
+        author_id,
+        author_username,
+        author_email,
+        object_type,
+    )
+    _append_to_digests(event, digest_preferences)
+
+
+@shared_task
+@set_code_owner_attribute
+def handle_event_digests(event_id):
+    """
+    Append a stored forum update to the digest of every digest subscriber.
+
+    Arguments:
+        event_id (int): The id of the ForumNotificationEvent.
+    """
+    try:
+        event = ForumNotificationEvent.objects.get(id=event_id)
+    except ForumNotificationEvent.DoesNotExist:
+        log.warning(f"Forum event {event_id} does not exist")
+        return
+
+    digest_preferences = _get_digest_preferences(event.course_id)
+
+    if digest_preferences:
+        _append_to_digests(event, digest_preferences)
+
+
+def _get_digest_preferences(course_id):
+    """
+    Get the digest preference of each user of a course with a digest preference.
+
+    Arguments:
+        course_id (str): The course id.
+    """
+    return {
+        user_id: preference
+        for user_id, preference in get_course_preferences(course_id).items()
+        if preference in DIGEST_PREFERENCES
+    }
+
+
+def _create_event(
+    thread_id,
+    discussion,
+    course_id,
+    body,
+    title,
+    url,
+    author_id,
+    author_username,
+    author_email,
+    object_type,
+):
+    """
+    Store a forum update as a ForumNotificationEvent.
+
+    The arguments are the same as in `handle_digests`.
+    """
+    return ForumNotificationEvent.objects.create(
+        thread_id=thread_id,
         course_id=course_id,
-    ).select_related("user")
-
-    for preference in digest_preferences:
-        digest, _ = ForumNotificationDigest.objects.get_or_create(
-            user=preference.user,
-            course_id=course_id,
-            defaults={
-                "threads_json": "[]",
-                "digest_type": preference.preference,
-            },
+        discussion=discussion,
+        body=body,
+        title=title,
+        url=url,
+        author_id=author_id,
+        author_username=author_username,
+        author_email=author_email,
+        object_type=object_type,
+    )
+
+
+def _append_to_digests(event, digest_preferences):
+    """
+    Append a forum update to the digests of the users, creating missing digests.
+
+    Arguments:
+        event (ForumNotificationEvent): The forum update.
+        digest_preferences (dict): The digest preference of each user id.
+    """
+    course_id = event.course_id
+    digests = ForumNotificationDigest.objects.filter(
+        course_id=course_id, user_id__in=list(digest_preferences)
+    ).only("id", "user_id", "digest_type")
+    digest_ids = {}
+    changed_digests = []
+
+    for digest in digests:
+        digest_ids[digest.user_id] = digest.id
+        if digest.digest_type != digest_preferences[digest.user_id]:
+            digest.digest_type = digest_preferences[digest.user_id]
+            changed_digests.append(digest)
+
+    ForumNotificationDigest.objects.bulk_update(
+        changed_digests, ["digest_type"], batch_size=BULK_BATCH_SIZE
+    )
+
+    missing_users = [user_id for user_id in digest_preferences if user_id not in digest_ids]
+
+    if missing_users:
+        now = timezone.now()
+        # Conflicts are ignored, the digest was created by a concurrent task
+        ForumNotificationDigest.objects.bulk_create(
+            [
+                ForumNotificationDigest(
+                    user_id=user_id,
+                    course_id=course_id,
+                    digest_type=digest_preferences[user_id],
+                    has_pending=True,
+                    next_due_at=now + DIGEST_INTERVALS[digest_preferences[user_id]],
+                )
+                for user_id in missing_users
+            ],
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True,
         )
-        threads_json = json.loads(digest.threads_json)
-        threads_json.append(
-            {
-                "thread_id": thread_id,
-                "discussion": discussion,
-                "body": body,
-                "title": title,
-                "url": url,
-                "author_id": author_id,
-                "author_username": author_username,
-                "author_email": author_email,
-                "object_type": object_type,
-            }
+        # The primary key of bulk created objects is not set by every backend,
+        # nor when conflicts are ignored
+        digest_ids.update(
+            ForumNotificationDigest.objects.filter(
+                course_id=course_id, user_id__in=missing_users
+            ).values_list("user_id", "id")
         )
 
-        digest.digest_type = preference.preference
-        digest.threads_json = json.dumps(threads_json)
-        digest.save()
+    ForumNotificationDigestEntry.objects.bulk_create(
+        [
+            ForumNotificationDigestEntry(digest_id=digest_id, event=event)
+            for digest_id in digest_ids.values()
+        ],
+        batch_size=BULK_BATCH_SIZE,
+    )
+    # The digests are flagged after the entries are inserted, so a concurrent
+    # send can't clear the flag of an entry it didn't see
+    ForumNotificationDigest.objects.filter(
+        id__in=list(digest_ids.values()), has_pending=False
+    ).update(has_pending=True)
 
 
 @shared_task
 @set_code_owner_attribute
 def send_digest(
     digest_id,
-    context,
+    context=None,
 ):
     """
     Send the acumulated digest to the user.
 
     Arguments:
         digest_id (str): The digest id.
-        context (dict): The context for the email.
+        context (dict, optional): The context for the email. Defaults to the base email
+            context, built by the worker.
+    """
+    lease_token = uuid4()
+
+    if not _claim_digests([digest_id], lease_token):
+        # Raises DoesNotExist when the digest doesn't exist
+        ForumNotificationDigest.objects.get(id=digest_id)
+        log.info(f"Digest {digest_id} is not due or is claimed by another worker")
+        return
+
+    # The digest is read once claimed, so the values saved by a worker that sent
+    # it meanwhile are not overwritten
+    digest = ForumNotificationDigest.objects.get(id=digest_id, lease_token=lease_token)
+    update_fields = ["lease_token", "lease_expires_at", "has_pending", "modified"]
+
+    try:
+        threads, entry_ids, more_count = _get_digest_items([digest.id]).get(
+            digest.id, ([], [], 0)
+        )
+
+        # The digest was already sent by another task, e.g. from an overlapping
+        # run of the forum_digest command
+        if not entry_ids:
+            log.info(f"Digest {digest_id} has no pending entries")
+            return
+
+        if context is None:
+            context = get_memoized_base_email_context()
+
+        user = digest.user
+        course = get_course_overview_or_none(digest.course_id)
+        language_preference = get_user_preference(user, LANGUAGE_KEY)
+
+        _send_digest_email(
+            digest, user, course, language_preference, threads, more_count, context
+        )
+
+        # Only the sent entries are deleted. Entries appended concurrently, even
+        # with a lower id committed late, are kept for the next digest.
+        ForumNotificationDigestEntry.objects.filter(id__in=entry_ids).delete()
+
+        digest.last_sent = timezone.now()
+        digest.next_due_at = digest.last_sent + DIGEST_INTERVALS[digest.digest_type]
+        update_fields += ["last_sent", "next_due_at"]
+    finally:
+        digest.lease_token = None
+        digest.lease_expires_at = None
+        # Entries appended while sending keep the digest pending
+        digest.has_pending = Exists(digest.entries.all())
+        digest.save(update_fields=update_fields)
+
+
+@shared_task
+@set_code_owner_attribute
+def send_digest_batch(
+    digest_ids,
+    context=None,
+):
+    """
+    Send the acumulated digests of several users.
+
+    The digests with their users and items, the language preferences and the
+    course overviews are loaded once for the whole batch, and the sent digests
+    are reset with a single update. Only the digests claimed by this task are sent.
+
+    Arguments:
+        digest_ids (list): The digest ids.
+        context (dict, optional): The context for the email. Defaults to the base email
+            context, built by the worker.
+    """
+    lease_token = uuid4()
+    _claim_digests(digest_ids, lease_token)
+    digests = list(
+        ForumNotificationDigest.objects.filter(lease_token=lease_token).select_related(
+            "user"
+        )
+    )
+
+    for digest_id in set(digest_ids) - {digest.id for digest in digests}:
+        log.warning(
+            f"Digest {digest_id} does not exist, is not due or is claimed by another worker"
+        )
+
+    if not digests:
+        return
+
+    if context is None:
+        context = get_memoized_base_email_context()
+
+    digest_items = _get_digest_items([digest.id for digest in digests])
+    courses = {
+        course_id: get_course_overview_or_none(course_id)
+        for course_id in {digest.course_id for digest in digests}
+    }
+    language_preferences = get_language_preferences(
+        digest.user_id for digest in digests
+    )
+    sent_digest_ids = []
+    sent_entry_ids = []
+
+    for digest in digests:
+        if digest.id not in digest_items:
+            log.info(f"Digest {digest.id} has no pending entries")
+            continue
+
+        threads, entry_ids, more_count = digest_items[digest.id]
+
+        try:
+            _send_digest_email(
+                digest,
+                digest.user,
+                courses[digest.course_id],
+                language_preferences.get(digest.user_id),
+                threads,
+                more_count,
+                dict(context),
+            )
+        except Exception:  # pylint: disable=broad-except
+            log.exception(f"Failed to send digest {digest.id}")
+            continue
+
+        sent_digest_ids.append(digest.id)
+        sent_entry_ids.extend(entry_ids)
+
+    ForumNotificationDigestEntry.objects.filter(id__in=sent_entry_ids).delete()
+
+    now = timezone.now()
+    # Entries appended while sending keep the digest pending
+    has_pending = Exists(
+        ForumNotificationDigestEntry.objects.filter(digest=OuterRef("pk"))
+    )
+    next_due_at = Case(
+        *[
+            When(digest_type=digest_type, then=Value(now + interval))
+            for digest_type, interval in DIGEST_INTERVALS.items()
+        ],
+        default=F("next_due_at"),
+        output_field=DateTimeField(),
+    )
+    ForumNotificationDigest.objects.filter(id__in=sent_digest_ids).update(
+        last_sent=now,
+        next_due_at=next_due_at,
+        lease_token=None,
+        lease_expires_at=None,
+        has_pending=has_pending,
+        modified=now,
+    )
+
+    if len(sent_digest_ids) < len(digests):
+        ForumNotificationDigest.objects.filter(lease_token=lease_token).update(
+            lease_token=None,
+            lease_expires_at=None,
+            has_pending=has_pending,
+            modified=now,
+        )
+
+
+def _claim_digests(digest_ids, lease_token):
+    """
+    Claim the due digests that are not claimed by another worker.
+
+    The claim is a single conditional update, so each digest is claimed by one
+    worker only. The lease of a worker that didn't release it expires after
+    `FORUM_NOTIFIER_DIGEST_LEASE_TIMEOUT` seconds. A digest is due one digest
+    interval after it was last sent, so a digest enqueued several times is not
+    sent again once sent, even with items appended meanwhile.
+
+    Arguments:
+        digest_ids (list): The digest ids.
+        lease_token (UUID): The token identifying the claim.
+
+    Returns:
+        int: The number of claimed digests.
+    """
+    now = timezone.now()
+    lease_timeout = getattr(settings, "FORUM_NOTIFIER_DIGEST_LEASE_TIMEOUT", 900)
+    due = Q()
+    for digest_type, interval in DIGEST_INTERVALS.items():
+        due |= Q(digest_type=digest_type, last_sent__lte=now - interval)
+
+    return (
+        ForumNotificationDigest.objects.filter(due, id__in=digest_ids)
+        .filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+        .update(
+            lease_token=lease_token,
+            lease_expires_at=now + timedelta(seconds=lease_timeout),
+            modified=now,
+        )
+    )
+
+
+def _get_digest_items(digest_ids):
+    """
+    Get the forum updates pending in the digests, compacted to the digest cap.
+
+    Only the thread and type of the pending entries are loaded to compact the
+    digests, and the forum updates are loaded once for the items kept. The
+    replies of a thread are grouped by the id of the thread, which is their
+    discussion id, and each item links to its thread through `post_id`.
+
+    Arguments:
+        digest_ids (list): The digest ids.
+
+    Returns:
+        dict: The items of each digest with pending entries, the ids of its
+            pending entries and the number of forum updates left out.
     """
-    digest = ForumNotificationDigest.objects.get(id=digest_id)
-    user = digest.user
+    max_items = getattr(settings, "FORUM_NOTIFIER_DIGEST_MAX_ITEMS", 100)
+    entries = {}
+    entry_ids = {}
+    post_ids = {}
+
+    for entry_id, digest_id, event_id, thread_id, discussion, object_type in (
+        ForumNotificationDigestEntry.objects.filter(digest_id__in=digest_ids)
+        .order_by("id")
+        .values_list(
+            "id",
+            "digest_id",
+            "event_id",
+            "event__thread_id",
+            "event__discussion",
+            "event__object_type",
+        )
+    ):
+        # The thread_id of responses and comments is their own id
+        if object_type == ForumObject.THREAD:
+            post_ids[event_id] = thread_id
+        else:
+            post_ids[event_id] = (discussion or {}).get("id", thread_id)
+        entries.setdefault(digest_id, []).append((event_id, post_ids[event_id], object_type))
+        entry_ids.setdefault(digest_id, []).append(entry_id)
+
+    compacted = {
+        digest_id: compact_digest_entries(digest_entries, max_items)
+        for digest_id, digest_entries in entries.items()
+    }
+    events = ForumNotificationEvent.objects.in_bulk(
+        {item["event_id"] for items, _ in compacted.values() for item in items}
+    )
+    digest_items = {}
+
+    for digest_id, (items, more_count) in compacted.items():
+        threads = []
+        for item in items:
+            thread = events[item["event_id"]].to_item()
+            thread["post_id"] = post_ids[item["event_id"]]
+            thread["responses_count"] = item["responses_count"]
+            thread["comments_count"] = item["comments_count"]
+            threads.append(thread)
+
+        digest_items[digest_id] = (threads, entry_ids[digest_id], more_count)
 
-    threads = json.loads(digest.threads_json)
+    return digest_items
 
-    for thread in threads:
-        thread["body"] = get_simplified_text(thread.get("body"))
 
-    course = get_course_overview_or_none(digest.course_id)
+def _send_digest_email(digest, user, course, language, threads, more_count, context):
+    """
+    Render and send the digest email to its user.
+
+    Arguments:
+        digest (ForumNotificationDigest): The digest.
+        user (User): The user of the digest.
+        course (CourseOverview): The course overview of the digest.
+        language (str): The language preference of the user.
+        threads (list): The forum updates of the digest.
+        more_count (int): The number of forum updates left out of the digest.
+        context (dict): The context for the email.
+    """
     lms_url = getattr(settings, "LMS_ROOT_URL", None)
     forum_notifier_url = (
         f"{lms_url}/courses/{digest.course_id}/instructor#view-forum_notifier"
     )
 
-    language_preference = get_user_preference(user, LANGUAGE_KEY)
-
     context.update(
         {
             "user": user,
             "course_id": digest.course_id,
             "course_name": course.display_name,
             "threads": threads,
+            "more_count": more_count,
             "forum_notifier_url": forum_notifier_url,
         }
     )
 
     send_digest_email_notification(
         recipient=Recipient(user.id, user.email),
-        language=language_preference,
+        language=language,
         user_context=context,
     )
-
-    digest.last_sent = timezone.now()
-    digest.threads_json = "[]"
-    digest.save()
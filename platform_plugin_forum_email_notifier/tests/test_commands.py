@@ -1,27 +1,32 @@
 """ Unit tests for commands in `platform_plugin_forum_email_notifier` plugin."""
+from argparse import ArgumentTypeError
 from datetime import timedelta
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 from unittest.mock import Mock, call, patch
 
-from django.core.management import CommandError
+from ddt import data, ddt, unpack
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase as DjangoTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 
-from platform_plugin_forum_email_notifier.management.commands.forum_digest import Command, DigestType, PreferenceOptions
+from platform_plugin_forum_email_notifier.management.commands.forum_digest import (
+    Command,
+    DigestType,
+    PreferenceOptions,
+    parse_shard,
+)
+from platform_plugin_forum_email_notifier.models import ForumNotificationDigest, ForumNotificationEvent
+from test_utils.digests import create_event
 
+User = get_user_model()
 COMMANDS_MODULE_PATH = "platform_plugin_forum_email_notifier.management.commands"
 
 
-class ForumNotificationDigestMock(Mock):
-    """
-    Mock class for `ForumNotificationDigest` model.
-    """
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    def __or__(self, other):
-        return [self, other]
-
-
+@ddt
 class TestCommand(TestCase):
     """
     Test suite for the Plugin Forum Email Notifier commands.
@@ -30,10 +35,16 @@ class TestCommand(TestCase):
     generate_digest_mock = patch(
         f"{COMMANDS_MODULE_PATH}.forum_digest.Command._generate_digest"
     )
+    delete_orphan_events_mock = patch(
+        f"{COMMANDS_MODULE_PATH}.forum_digest.delete_orphan_events"
+    )
     filter_mock = patch(
         f"{COMMANDS_MODULE_PATH}.forum_digest.ForumNotificationDigest.objects.filter"
     )
     send_digest_mock = patch(f"{COMMANDS_MODULE_PATH}.forum_digest.send_digest.delay")
+    send_digest_batch_mock = patch(
+        f"{COMMANDS_MODULE_PATH}.forum_digest.send_digest_batch.delay"
+    )
     get_context_mock = patch(
         f"{COMMANDS_MODULE_PATH}.forum_digest.get_base_email_context"
     )
@@ -53,8 +64,11 @@ class TestCommand(TestCase):
 
         self.assertEqual("You must specify a digest type", str(context.exception))
 
+    @delete_orphan_events_mock
     @generate_digest_mock
-    def test_handle_daily_digest(self, mock_generate_digest: Mock):
+    def test_handle_daily_digest(
+        self, mock_generate_digest: Mock, mock_delete_orphan_events: Mock
+    ):
         """
         Check `_generate_digest` command behavior when a daily digest is specified.
         """
@@ -64,10 +78,15 @@ class TestCommand(TestCase):
             PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
             DigestType.DAILY,
             interval=timedelta(days=1),
+            shard=(0, 1),
         )
+        mock_delete_orphan_events.assert_called_once()
 
+    @delete_orphan_events_mock
     @generate_digest_mock
-    def test_handle_weekly_digest(self, mock_generate_digest: Mock):
+    def test_handle_weekly_digest(
+        self, mock_generate_digest: Mock, mock_delete_orphan_events: Mock
+    ):
         """
         Check `_generate_digest` command behavior when a weekly digest is specified.
         """
@@ -77,7 +96,50 @@ class TestCommand(TestCase):
             PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
             DigestType.WEEKLY,
             interval=timedelta(days=7),
+            shard=(0, 1),
         )
+        mock_delete_orphan_events.assert_called_once()
+
+    @delete_orphan_events_mock
+    @generate_digest_mock
+    def test_handle_sharded_digest(
+        self, mock_generate_digest: Mock, mock_delete_orphan_events: Mock
+    ):
+        """
+        Check `_generate_digest` command behavior when a shard is specified.
+
+        Expected result:
+            - The digest is generated for the shard.
+            - The orphan events are only deleted by the first shard.
+        """
+        self.command.handle(digest=DigestType.DAILY, shard=(1, 4))
+
+        mock_generate_digest.assert_called_once_with(
+            PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+            DigestType.DAILY,
+            interval=timedelta(days=1),
+            shard=(1, 4),
+        )
+        mock_delete_orphan_events.assert_not_called()
+
+    @data(
+        ("0/1", (0, 1)),
+        ("3/4", (3, 4)),
+    )
+    @unpack
+    def test_shard(self, value: str, expected: tuple):
+        """
+        Check that the `--shard` option is parsed as `(index, count)`.
+        """
+        self.assertEqual(expected, parse_shard(value))
+
+    @data("1", "a/b", "4/4", "-1/4", "0/0")
+    def test_invalid_shard(self, value: str):
+        """
+        Check that an invalid `--shard` option is rejected.
+        """
+        with self.assertRaises(ArgumentTypeError):
+            parse_shard(value)
 
     @get_context_mock
     @filter_mock
@@ -90,11 +152,10 @@ class TestCommand(TestCase):
         """
         context = {"foo": "bar"}
         mock_get_context.return_value = context
-        mock_already_digest = ForumNotificationDigestMock(id=1)
-        mock_never_digest = ForumNotificationDigestMock(id=2)
-        mock_filter.return_value.exclude.side_effect = [
-            mock_already_digest,
-            mock_never_digest,
+        mock_digests = mock_filter.return_value
+        mock_digests.values_list.return_value.order_by.return_value.iterator.return_value = [
+            (1, 10, "course-v1:edX+Test+2024"),
+            (2, 20, "course-v1:edX+Test+2024"),
         ]
 
         self.command._generate_digest(  # pylint: disable=protected-access
@@ -103,10 +164,351 @@ class TestCommand(TestCase):
             timedelta(days=1),
         )
 
-        self.assertEqual(2, mock_filter.call_count)
+        mock_filter.assert_called_once()
+        mock_digests.values_list.assert_called_once_with("id", "user_id", "course_id")
+        mock_get_context.assert_called_once()
         mock_send_digest.assert_has_calls(
             [
-                call(mock_already_digest.id, context=context),
-                call(mock_never_digest.id, context=context),
+                call(1, context=context),
+                call(2, context=context),
             ]
         )
+
+    @override_settings(FORUM_NOTIFIER_DIGEST_BATCH_SIZE=2)
+    @get_context_mock
+    @filter_mock
+    @send_digest_mock
+    @send_digest_batch_mock
+    def test_generate_digest_batched(
+        self,
+        mock_send_digest_batch: Mock,
+        mock_send_digest: Mock,
+        mock_filter: Mock,
+        mock_get_context: Mock,
+    ):
+        """
+        Check `_generate_digest` behavior when the digests are sent in batches.
+
+        Expected result:
+            - One `send_digest_batch` task is enqueued per batch of digests.
+        """
+        context = {"foo": "bar"}
+        mock_get_context.return_value = context
+        mock_digests = mock_filter.return_value
+        mock_digests.values_list.return_value.order_by.return_value.iterator.return_value = [
+            (1, 10, "course-v1:edX+Test+2024"),
+            (2, 20, "course-v1:edX+Test+2024"),
+            (3, 30, "course-v1:edX+Test+2024"),
+        ]
+
+        self.command._generate_digest(  # pylint: disable=protected-access
+            PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+            DigestType.DAILY,
+            timedelta(days=1),
+        )
+
+        mock_send_digest_batch.assert_has_calls(
+            [
+                call([1, 2], context=context),
+                call([3], context=context),
+            ]
+        )
+        mock_send_digest.assert_not_called()
+
+    @get_context_mock
+    @filter_mock
+    @send_digest_mock
+    def test_generate_sharded_digest(
+        self, mock_send_digest: Mock, mock_filter: Mock, mock_get_context: Mock
+    ):
+        """
+        Check `_generate_digest` behavior when generating the digests of a shard.
+
+        Expected result:
+            - Only the digests of the users in the shard are generated.
+        """
+        mock_get_context.return_value = {}
+        mock_digests = mock_filter.return_value
+        mock_sharded_digests = mock_digests.annotate.return_value.filter.return_value
+        mock_sharded_digests.values_list.return_value.order_by.return_value.iterator.return_value = [
+            (1, 5, "course-v1:edX+Test+2024"),
+        ]
+
+        self.command._generate_digest(  # pylint: disable=protected-access
+            PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+            DigestType.DAILY,
+            timedelta(days=1),
+            shard=(1, 4),
+        )
+
+        mock_digests.annotate.assert_called_once_with(shard=F("user_id") % 4)
+        mock_digests.annotate.return_value.filter.assert_called_once_with(shard=1)
+        mock_send_digest.assert_called_once_with(1, context={})
+
+
+class TestGenerateDigestQuery(DjangoTestCase):
+    """
+    Test suite for the selection of the digests to send.
+    """
+
+    def setUp(self) -> None:
+        """
+        Set up digests in every state.
+        """
+        self.command = Command()
+        now = timezone.now()
+        digests = {
+            "never_sent": (PreferenceOptions.ALL_POSTS_DAILY_DIGEST, True, None),
+            "sent_long_ago": (
+                PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+                True,
+                now - timedelta(days=2),
+            ),
+            "sent_recently": (
+                PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+                True,
+                now - timedelta(hours=1),
+            ),
+            "not_pending": (PreferenceOptions.ALL_POSTS_DAILY_DIGEST, False, None),
+            "weekly": (PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST, True, None),
+        }
+        self.digests = {}
+        for name, (digest_type, has_pending, last_sent) in digests.items():
+            digest = ForumNotificationDigest(
+                user=User.objects.create(username=name),
+                course_id="course-v1:edX+Test+2024",
+                digest_type=digest_type,
+                has_pending=has_pending,
+            )
+            if last_sent:
+                digest.last_sent = last_sent
+            digest.save()
+            self.digests[name] = digest
+
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest.get_base_email_context", Mock())
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest.send_digest.delay")
+    def test_generate_digest(self, mock_send_digest: Mock):
+        """
+        Check that only the pending digests of the type not sent in the interval are sent.
+        """
+        self.command._generate_digest(  # pylint: disable=protected-access
+            PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+            DigestType.DAILY,
+            timedelta(days=1),
+        )
+
+        self.assertEqual(
+            {self.digests["never_sent"].id, self.digests["sent_long_ago"].id},
+            {digest_call.args[0] for digest_call in mock_send_digest.call_args_list},
+        )
+
+    @skipUnless(connection.vendor == "sqlite", "The query plan is checked on SQLite")
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest.get_base_email_context", Mock())
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest.send_digest.delay", Mock())
+    def test_generate_digest_query_plan(self):
+        """
+        Check that the digests are selected with a single query on the digest
+        selection index.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.command._generate_digest(  # pylint: disable=protected-access
+                PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+                DigestType.DAILY,
+                timedelta(days=1),
+            )
+
+        self.assertEqual(1, len(queries))
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}")
+            query_plan = " ".join(str(row) for row in cursor.fetchall())
+
+        self.assertIn("INDEX forum_digest_pending_idx", query_plan)
+        self.assertIn("digest_type=? AND has_pending=? AND last_sent<?", query_plan)
+
+
+@ddt
+class TestForumDigestScheduler(DjangoTestCase):
+    """
+    Test suite for the `forum_digest_scheduler` command.
+    """
+
+    send_digest_batch_mock = patch(
+        f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.send_digest_batch.delay"
+    )
+    get_context_mock = patch(
+        f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.get_base_email_context",
+        Mock(return_value={}),
+    )
+
+    def setUp(self) -> None:
+        """
+        Set up due, not yet due and not pending digests.
+        """
+        # Closing the connection would break the transaction of the test
+        close_old_connections_patcher = patch(
+            f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.close_old_connections"
+        )
+        self.mock_close_old_connections = close_old_connections_patcher.start()
+        self.addCleanup(close_old_connections_patcher.stop)
+
+        now = timezone.now()
+        digests = {
+            "due_first": (True, now - timedelta(hours=2)),
+            "due_second": (True, now - timedelta(hours=1)),
+            "not_due": (True, now + timedelta(hours=1)),
+            "not_pending": (False, now - timedelta(hours=1)),
+        }
+        self.digests = {
+            name: ForumNotificationDigest.objects.create(
+                user=User.objects.create(username=name),
+                course_id="course-v1:edX+Test+2024",
+                digest_type=PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+                has_pending=has_pending,
+                next_due_at=next_due_at,
+            )
+            for name, (has_pending, next_due_at) in digests.items()
+        }
+
+    @override_settings(FORUM_NOTIFIER_DIGEST_LEASE_TIMEOUT=600)
+    @get_context_mock
+    @send_digest_batch_mock
+    def test_schedule_due_digests(self, mock_send_digest_batch: Mock):
+        """
+        Check that the due digests are enqueued in batches, the oldest first.
+
+        Expected result:
+            - One task is enqueued per batch of due digests.
+            - The enqueued digests are postponed by the lease timeout.
+            - The digests not due or not pending are not enqueued.
+        """
+        call_command("forum_digest_scheduler", "--once", "--batch-size", "1")
+
+        mock_send_digest_batch.assert_has_calls(
+            [
+                call([self.digests["due_first"].id], context={}),
+                call([self.digests["due_second"].id], context={}),
+            ]
+        )
+        self.assertEqual(2, mock_send_digest_batch.call_count)
+        postponed_digest = ForumNotificationDigest.objects.get(
+            id=self.digests["due_first"].id
+        )
+        self.assertGreater(
+            postponed_digest.next_due_at, timezone.now() + timedelta(seconds=590)
+        )
+
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.time.sleep")
+    @get_context_mock
+    @send_digest_batch_mock
+    def test_schedule_waits_when_nothing_is_due(
+        self, mock_send_digest_batch: Mock, mock_sleep: Mock
+    ):
+        """
+        Check that the scheduler waits the poll interval when no digest is due.
+        """
+        mock_sleep.side_effect = KeyboardInterrupt
+        ForumNotificationDigest.objects.update(has_pending=False)
+
+        with self.assertRaises(KeyboardInterrupt):
+            call_command("forum_digest_scheduler", "--poll-interval", "30")
+
+        mock_send_digest_batch.assert_not_called()
+        mock_sleep.assert_called_once_with(30)
+        self.mock_close_old_connections.assert_called_once()
+
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.Command._schedule_due_digests")
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.delete_orphan_events")
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.time.sleep")
+    def test_schedule_survives_errors(
+        self, mock_sleep: Mock, mock_delete_orphan_events: Mock, mock_schedule_due_digests: Mock
+    ):
+        """
+        Check that the scheduler logs a failed iteration and retries after the poll interval.
+
+        Expected result:
+            - The errors are logged and the scheduler waits the poll interval.
+            - The due digests are scheduled in the next iteration.
+            - The connections are checked at the start of every iteration.
+        """
+        mock_delete_orphan_events.side_effect = Exception("database is gone")
+        mock_schedule_due_digests.side_effect = [Exception("database is gone"), 2, 0]
+        mock_sleep.side_effect = [None, KeyboardInterrupt]
+
+        with self.assertLogs(
+            f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler", level="ERROR"
+        ) as logs:
+            with self.assertRaises(KeyboardInterrupt):
+                call_command(
+                    "forum_digest_scheduler",
+                    "--poll-interval",
+                    "30",
+                    "--orphan-events-interval",
+                    "0",
+                )
+
+        self.assertEqual(
+            [
+                "Failed to delete the orphan forum events",
+                "Failed to schedule the due digests",
+            ],
+            [record.getMessage() for record in logs.records[:2]],
+        )
+        mock_sleep.assert_has_calls([call(30), call(30)])
+        self.assertEqual(3, mock_schedule_due_digests.call_count)
+        self.assertEqual(3, mock_delete_orphan_events.call_count)
+        self.assertEqual(3, self.mock_close_old_connections.call_count)
+
+    @get_context_mock
+    @send_digest_batch_mock
+    def test_schedule_once_raises_errors(self, mock_send_digest_batch: Mock):
+        """
+        Check that the failure to schedule the digests is raised with `--once`.
+        """
+        mock_send_digest_batch.side_effect = Exception("broker is gone")
+
+        with self.assertRaises(Exception):
+            call_command("forum_digest_scheduler", "--once")
+
+    @get_context_mock
+    @send_digest_batch_mock
+    def test_schedule_deletes_orphan_events(self, mock_send_digest_batch: Mock):  # pylint: disable=unused-argument
+        """
+        Check that the scheduler deletes the forum events already sent in every digest.
+
+        Expected result:
+            - Old events without digest entries are deleted.
+            - Recent events are kept.
+        """
+        events = [create_event(thread_id=f"test-thread-id-{index}") for index in range(2)]
+        ForumNotificationEvent.objects.filter(id=events[0].id).update(
+            created=timezone.now() - timedelta(days=2)
+        )
+
+        call_command("forum_digest_scheduler", "--once")
+
+        self.assertEqual(
+            [events[1].id], list(ForumNotificationEvent.objects.values_list("id", flat=True))
+        )
+
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.delete_orphan_events")
+    @patch(f"{COMMANDS_MODULE_PATH}.forum_digest_scheduler.time.sleep")
+    @data(("3600", 1), ("0", 3))
+    @unpack
+    def test_schedule_orphan_events_interval(
+        self, orphan_events_interval: str, expected_calls: int, mock_sleep: Mock, mock_delete_orphan_events: Mock
+    ):
+        """
+        Check that the orphan events are deleted once per interval.
+
+        Expected result:
+            - The events are deleted on the first iteration and after every interval.
+        """
+        mock_sleep.side_effect = [None, None, KeyboardInterrupt]
+        ForumNotificationDigest.objects.update(has_pending=False)
+
+        with self.assertRaises(KeyboardInterrupt):
+            call_command(
+                "forum_digest_scheduler", "--orphan-events-interval", orphan_events_interval
+            )
+
+        self.assertEqual(expected_calls, mock_delete_orphan_events.call_count)
@@ -0,0 +1,112 @@
+""" Unit tests for signal handlers in `platform_plugin_forum_email_notifier` plugin."""
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from ddt import data, ddt, unpack
+from django.test.utils import override_settings
+
+from platform_plugin_forum_email_notifier.handlers import (
+    forum_comment_created_handler,
+    forum_preference_changed_handler,
+    forum_response_created_handler,
+    forum_thread_created_handler,
+)
+from platform_plugin_forum_email_notifier.models import ForumNotificationPreference
+from platform_plugin_forum_email_notifier.tasks import notify_users
+from platform_plugin_forum_email_notifier.utils import ForumObject
+
+HANDLERS_MODULE_PATH = "platform_plugin_forum_email_notifier.handlers"
+
+
+class TestForumPreferenceChangedHandler(TestCase):
+    """Unit test for `forum_preference_changed_handler` receiver."""
+
+    @patch(f"{HANDLERS_MODULE_PATH}.invalidate_course_preferences")
+    @patch(f"{HANDLERS_MODULE_PATH}.transaction.on_commit")
+    def test_invalidate_on_commit(
+        self, mock_on_commit: Mock, mock_invalidate_course_preferences: Mock
+    ):
+        """
+        Check that the course preferences are invalidated when a preference changes.
+
+        Expected result:
+            - The invalidation is deferred until the transaction is committed.
+        """
+        instance = Mock(spec=ForumNotificationPreference, course_id="test-course-id")
+
+        forum_preference_changed_handler(ForumNotificationPreference, instance)
+
+        mock_invalidate_course_preferences.assert_not_called()
+        mock_on_commit.call_args.args[0]()
+        mock_invalidate_course_preferences.assert_called_once_with("test-course-id")
+
+
+@ddt
+class TestForumEventHandlers(TestCase):
+    """Unit test for the forum event receivers."""
+
+    @patch(f"{HANDLERS_MODULE_PATH}.notify_users.delay")
+    @data(
+        (forum_thread_created_handler, ForumObject.THREAD),
+        (forum_response_created_handler, ForumObject.RESPONSE),
+        (forum_comment_created_handler, ForumObject.COMMENT),
+    )
+    @unpack
+    def test_notify_users(self, handler, object_type: ForumObject, mock_notify_users: Mock):
+        """
+        Check that the forum update is sent to `notify_users`.
+
+        Expected result:
+            - The task is enqueued without the email context, built by the workers.
+        """
+        thread = Mock()
+
+        handler(signal=Mock(), sender=None, thread=thread, metadata=Mock())
+
+        mock_notify_users.assert_called_once_with(
+            thread.id,
+            thread.discussion,
+            thread.course_id,
+            thread.body,
+            thread.title,
+            thread.url,
+            thread.user.id,
+            thread.user.pii.username,
+            thread.user.pii.email,
+            object_type=object_type,
+        )
+
+    @override_settings(FORUM_NOTIFIER_DEFER_NOTIFICATIONS=True)
+    @patch(f"{HANDLERS_MODULE_PATH}.get_task_buffer")
+    @patch(f"{HANDLERS_MODULE_PATH}.transaction.on_commit")
+    @patch(f"{HANDLERS_MODULE_PATH}.notify_users.delay")
+    def test_notify_users_deferred(
+        self, mock_notify_users: Mock, mock_on_commit: Mock, mock_get_task_buffer: Mock
+    ):
+        """
+        Check that the task is buffered once the transaction is committed.
+
+        Expected result:
+            - The task is not enqueued by the request.
+            - The task is added to the task buffer on commit.
+        """
+        thread = Mock()
+
+        forum_thread_created_handler(signal=Mock(), sender=None, thread=thread, metadata=Mock())
+
+        mock_get_task_buffer.return_value.put.assert_not_called()
+        mock_on_commit.call_args.args[0]()
+        mock_notify_users.assert_not_called()
+        mock_get_task_buffer.return_value.put.assert_called_once_with(
+            notify_users,
+            thread.id,
+            thread.discussion,
+            thread.course_id,
+            thread.body,
+            thread.title,
+            thread.url,
+            thread.user.id,
+            thread.user.pii.username,
+            thread.user.pii.email,
+            object_type=ForumObject.THREAD,
+        )
@@ -1,26 +1,42 @@
 """ Unit tests for celery tasks in `platform_plugin_forum_email_notifier` plugin."""
-import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import ANY, Mock, call, patch
+from uuid import uuid4
 
 from ddt import data, ddt, unpack
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
-from django.test.utils import override_settings
+from django.db import connection
+from django.db.models import Exists
+from django.test import TestCase as DjangoTestCase
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 from edx_ace.recipient import Recipient
 
 from platform_plugin_forum_email_notifier.models import (
     ForumNotificationDigest,
-    ForumNotificationPreference,
+    ForumNotificationDigestEntry,
+    ForumNotificationEvent,
     PreferenceOptions,
+    digest_never_sent,
 )
 from platform_plugin_forum_email_notifier.tasks import (
+    _claim_digests,
     handle_digests,
+    handle_event_digests,
     notify_users,
     send_digest,
+    send_digest_batch,
     send_email_notification,
+    send_email_notification_batch,
+    send_event_notification,
+    send_event_notification_batch,
 )
 from platform_plugin_forum_email_notifier.utils import ForumObject
+from test_utils.digests import DigestTestMixin, create_event, create_users
 
 User = get_user_model()
 TASKS_MODULE_PATH = "platform_plugin_forum_email_notifier.tasks"
@@ -47,7 +63,7 @@ class TestSendEmailNotification(TestCase):
             "thread_id": "test-thread-id",
             "discussion": None,
             "course_id": "test-course-id",
-            "body": "<p>test-body<p>",
+            "body": "test-body",
             "title": "test-title",
             "url": "test-url/",
             "author_id": 1,
@@ -189,36 +205,211 @@ class TestSendEmailNotification(TestCase):
         )
 
 
+class TestSendEmailNotificationBatch(TestCase):
+    """Unit test for `send_email_notification_batch` task."""
+
+    in_bulk_mock = patch(f"{TASKS_MODULE_PATH}.User.objects.in_bulk")
+    get_course_overview_or_none_mock = patch(
+        f"{TASKS_MODULE_PATH}.get_course_overview_or_none"
+    )
+    get_language_preferences_mock = patch(
+        f"{TASKS_MODULE_PATH}.get_language_preferences"
+    )
+    send_forum_email_notification_mock = patch(
+        f"{TASKS_MODULE_PATH}.send_forum_email_notification"
+    )
+
+    def setUp(self) -> None:
+        """
+        Set up common test data for each test case.
+        """
+        self.send_email_notification_batch_args = {
+            "thread_id": "test-thread-id",
+            "discussion": None,
+            "course_id": "test-course-id",
+            "body": "test-body",
+            "title": "test-title",
+            "url": "test-url/",
+            "author_id": 1,
+            "author_username": "test-author-username",
+            "author_email": "test@author-email.com",
+            "object_type": ForumObject.THREAD,
+            "subscribers": [1, 2, 3],
+            "context": {"foo": "bar"},
+        }
+
+    @in_bulk_mock
+    @get_course_overview_or_none_mock
+    @get_language_preferences_mock
+    @send_forum_email_notification_mock
+    def test_send_email_notification_batch(
+        self,
+        mock_send_forum_email_notification: Mock,
+        mock_get_language_preferences: Mock,
+        mock_get_course_overview_or_none: Mock,
+        mock_in_bulk: Mock,
+    ):
+        """
+        Check `send_email_notification_batch` behavior for a batch of subscribers.
+
+        Expected result:
+            - Users, course and language preferences are loaded once per batch.
+            - An email notification is sent to every existing user of the batch.
+        """
+        first_user = Mock(spec=User, id=1, email="first@user-email.com")
+        second_user = Mock(spec=User, id=2, email="second@user-email.com")
+        mock_in_bulk.return_value = {1: first_user, 2: second_user}
+        mock_get_course_overview_or_none.return_value = Mock(
+            display_name="test-course-name"
+        )
+        mock_get_language_preferences.return_value = {1: "es-419"}
+
+        send_email_notification_batch(**self.send_email_notification_batch_args)
+
+        mock_in_bulk.assert_called_once_with([1, 2, 3])
+        mock_get_course_overview_or_none.assert_called_once_with("test-course-id")
+        mock_get_language_preferences.assert_called_once()
+        self.assertEqual(2, mock_send_forum_email_notification.call_count)
+        first_call, second_call = mock_send_forum_email_notification.call_args_list
+        self.assertEqual(
+            first_call.kwargs["recipient"], Recipient(1, "first@user-email.com")
+        )
+        self.assertEqual(first_call.kwargs["language"], "es-419")
+        self.assertEqual(first_call.kwargs["user_context"]["body"], "test-body")
+        self.assertEqual(first_call.kwargs["user_context"]["foo"], "bar")
+        self.assertEqual(
+            second_call.kwargs["recipient"], Recipient(2, "second@user-email.com")
+        )
+        self.assertIsNone(second_call.kwargs["language"])
+        self.assertIs(second_call.kwargs["user_context"]["user"], second_user)
+
+    @in_bulk_mock
+    @get_course_overview_or_none_mock
+    @get_language_preferences_mock
+    @send_forum_email_notification_mock
+    def test_send_email_notification_batch_failed_email(
+        self,
+        mock_send_forum_email_notification: Mock,
+        mock_get_language_preferences: Mock,
+        mock_get_course_overview_or_none: Mock,  # pylint: disable=unused-argument
+        mock_in_bulk: Mock,
+    ):
+        """
+        Check `send_email_notification_batch` behavior when an email fails.
+
+        Expected result:
+            - The failure is logged and the rest of the batch is notified.
+        """
+        mock_in_bulk.return_value = {
+            1: Mock(spec=User, id=1, email="first@user-email.com"),
+            2: Mock(spec=User, id=2, email="second@user-email.com"),
+        }
+        mock_get_language_preferences.return_value = {}
+        mock_send_forum_email_notification.side_effect = [Exception, None]
+
+        with self.assertLogs(TASKS_MODULE_PATH, level="ERROR"):
+            send_email_notification_batch(**self.send_email_notification_batch_args)
+
+        self.assertEqual(2, mock_send_forum_email_notification.call_count)
+
+    @patch(f"{TASKS_MODULE_PATH}.get_memoized_base_email_context")
+    @in_bulk_mock
+    @get_course_overview_or_none_mock
+    @get_language_preferences_mock
+    @send_forum_email_notification_mock
+    def test_send_email_notification_batch_worker_context(
+        self,
+        mock_send_forum_email_notification: Mock,
+        mock_get_language_preferences: Mock,  # pylint: disable=unused-argument
+        mock_get_course_overview_or_none: Mock,  # pylint: disable=unused-argument
+        mock_in_bulk: Mock,
+        mock_get_memoized_base_email_context: Mock,
+    ):
+        """
+        Check `send_email_notification_batch` behavior when no context is received.
+
+        Expected result:
+            - The base email context is built by the worker once per batch.
+            - Every user receives its own copy of the context.
+        """
+        mock_in_bulk.return_value = {
+            1: Mock(spec=User, id=1, email="first@user-email.com"),
+            2: Mock(spec=User, id=2, email="second@user-email.com"),
+        }
+        mock_get_memoized_base_email_context.return_value = {"platform_name": "test-platform"}
+
+        send_email_notification_batch(**{**self.send_email_notification_batch_args, "context": None})
+
+        mock_get_memoized_base_email_context.assert_called_once_with()
+        first_call, second_call = mock_send_forum_email_notification.call_args_list
+        self.assertEqual("test-platform", first_call.kwargs["user_context"]["platform_name"])
+        self.assertIsNot(first_call.kwargs["user_context"], second_call.kwargs["user_context"])
+
+    @in_bulk_mock
+    @get_course_overview_or_none_mock
+    @send_forum_email_notification_mock
+    def test_send_email_notification_batch_no_users(
+        self,
+        mock_send_forum_email_notification: Mock,
+        mock_get_course_overview_or_none: Mock,
+        mock_in_bulk: Mock,
+    ):
+        """
+        Check `send_email_notification_batch` behavior when no user exists.
+
+        Expected result:
+            - No email notification is sent and the course is not loaded.
+        """
+        mock_in_bulk.return_value = {}
+
+        send_email_notification_batch(**self.send_email_notification_batch_args)
+
+        mock_get_course_overview_or_none.assert_not_called()
+        mock_send_forum_email_notification.assert_not_called()
+
+
 @ddt
 class TestNotifyUsers(TestCase):
     """
     Unit test for `notify_users` task."""
 
-    get_user_mock = patch(f"{TASKS_MODULE_PATH}.User.objects.get")
-    get_forum_mock = patch(
-        f"{TASKS_MODULE_PATH}.ForumNotificationPreference.objects.get"
-    )
-    get_staff_subscribers_mock = patch(f"{TASKS_MODULE_PATH}.get_staff_subscribers")
-    get_subscribers_mock = patch(f"{TASKS_MODULE_PATH}.get_subscribers")
+    get_course_preferences_mock = patch(f"{TASKS_MODULE_PATH}.get_course_preferences")
+    iter_subscribers_mock = patch(f"{TASKS_MODULE_PATH}.iter_subscribers")
     send_email_notification_mock = patch(
         f"{TASKS_MODULE_PATH}.send_email_notification.delay"
     )
+    send_email_notification_batch_mock = patch(
+        f"{TASKS_MODULE_PATH}.send_email_notification_batch.delay"
+    )
     handle_digests_mock = patch(f"{TASKS_MODULE_PATH}.handle_digests.delay")
 
-    @get_user_mock
-    @get_forum_mock
-    @get_staff_subscribers_mock
-    @get_subscribers_mock
+    def setUp(self) -> None:
+        """
+        Set up common test data for each test case.
+        """
+        self.notify_users_args = (
+            "test-thread-id",
+            {},
+            "test-course-id",
+            "test-body",
+            "test-title",
+            "test-url/",
+            "test-author-id",
+            "test-author-username",
+            "test@author-email.com",
+            ForumObject.THREAD,
+        )
+
+    @get_course_preferences_mock
+    @iter_subscribers_mock
     @send_email_notification_mock
     @handle_digests_mock
     def test_notify_users_thread(
         self,
         mock_handle_digests: Mock,
         mock_send_email_notification: Mock,
-        mock_get_subscribers: Mock,
-        mock_get_staff_subscribers: Mock,
-        mock_get_forum_notification_preference: Mock,
-        mock_get_user: Mock,
+        mock_iter_subscribers: Mock,
+        mock_get_course_preferences: Mock,
     ):
         """
         Check `notify_users` behavior for thread object type.
@@ -227,52 +418,118 @@ class TestNotifyUsers(TestCase):
             - Send an email notification to all subscribers.
             - A digest is created for all staff subscribers.
         """
-        mock_get_subscribers.return_value = set([1])
-        mock_get_staff_subscribers.return_value = set([2])
-        mock_get_user.return_value = Mock(spec=User, id=1, email="test@user-email.com")
-        mock_get_forum_notification_preference.return_value = Mock(
-            spec=ForumNotificationPreference, preference=PreferenceOptions.ALL_POSTS
+        mock_iter_subscribers.return_value = iter([1])
+        mock_get_course_preferences.return_value = {2: PreferenceOptions.ALL_POSTS}
+
+        notify_users(*self.notify_users_args, context={})
+
+        mock_get_course_preferences.assert_called_once_with("test-course-id")
+        mock_send_email_notification.assert_has_calls(
+            [
+                call(*self.notify_users_args, 1, {}),
+                call(*self.notify_users_args, 2, {}),
+            ],
+            any_order=True,
         )
+        mock_handle_digests.assert_called_with(*self.notify_users_args)
 
-        notify_users(
-            thread_id="test-thread-id",
-            discussion={},
-            course_id="test-course-id",
-            body="test-body",
-            title="test-title",
-            url="test-url/",
-            author_id="test-author-id",
-            author_username="test-author-username",
-            author_email="test@author-email.com",
-            object_type=ForumObject.THREAD,
-            context={},
+    @patch(f"{TASKS_MODULE_PATH}.get_simplified_text")
+    @get_course_preferences_mock
+    @iter_subscribers_mock
+    @send_email_notification_mock
+    @handle_digests_mock
+    def test_notify_users_simplified_body(
+        self,
+        mock_handle_digests: Mock,
+        mock_send_email_notification: Mock,
+        mock_iter_subscribers: Mock,
+        mock_get_course_preferences: Mock,
+        mock_get_simplified_text: Mock,
+    ):
+        """
+        Test that the body is simplified once for every recipient and the digests.
+
+        Expected result:
+            - The body is simplified once.
+            - The simplified body is sent to the notifications and digests.
+        """
+        mock_iter_subscribers.return_value = iter([1, 2, 3])
+        mock_get_course_preferences.return_value = {}
+        mock_get_simplified_text.return_value = "simplified-body"
+        body_index = 3
+
+        notify_users(*self.notify_users_args, context={})
+
+        mock_get_simplified_text.assert_called_once_with(self.notify_users_args[body_index])
+        for notification_call in mock_send_email_notification.call_args_list:
+            self.assertEqual("simplified-body", notification_call.args[body_index])
+        self.assertEqual(
+            "simplified-body", mock_handle_digests.call_args.args[body_index]
         )
 
-        mock_send_email_notification.assert_called_with(
-            "test-thread-id",
-            {},
-            "test-course-id",
-            "test-body",
-            "test-title",
-            "test-url/",
-            "test-author-id",
-            "test-author-username",
-            "test@author-email.com",
-            ForumObject.THREAD,
-            2,
-            {},
+    @override_settings(FORUM_NOTIFIER_NOTIFICATION_BATCH_SIZE=2)
+    @get_course_preferences_mock
+    @iter_subscribers_mock
+    @send_email_notification_mock
+    @send_email_notification_batch_mock
+    @handle_digests_mock
+    def test_notify_users_batched(
+        self,
+        mock_handle_digests: Mock,
+        mock_send_email_notification_batch: Mock,
+        mock_send_email_notification: Mock,
+        mock_iter_subscribers: Mock,
+        mock_get_course_preferences: Mock,
+    ):
+        """
+        Check `notify_users` behavior when batched fan-out is enabled.
+
+        Expected result:
+            - One batch task is enqueued per chunk of subscribers.
+            - No per-subscriber task is enqueued.
+        """
+        mock_iter_subscribers.return_value = iter([1, 2, 3])
+        mock_get_course_preferences.return_value = {}
+
+        notify_users(*self.notify_users_args, context={})
+
+        mock_send_email_notification.assert_not_called()
+        mock_send_email_notification_batch.assert_has_calls(
+            [
+                call(*self.notify_users_args, [1, 2], {}),
+                call(*self.notify_users_args, [3], {}),
+            ]
         )
-        mock_handle_digests.assert_called_with(
-            "test-thread-id",
-            {},
-            "test-course-id",
-            "test-body",
-            "test-title",
-            "test-url/",
-            "test-author-id",
-            "test-author-username",
-            "test@author-email.com",
-            ForumObject.THREAD,
+        mock_handle_digests.assert_called_once_with(*self.notify_users_args)
+
+    @get_course_preferences_mock
+    @iter_subscribers_mock
+    @send_email_notification_mock
+    @handle_digests_mock
+    def test_notify_users_no_duplicates(
+        self,
+        mock_handle_digests: Mock,  # pylint: disable=unused-argument
+        mock_send_email_notification: Mock,
+        mock_iter_subscribers: Mock,
+        mock_get_course_preferences: Mock,
+    ):
+        """
+        Check `notify_users` behavior for staff users that follow the thread.
+
+        Expected result:
+            - Staff users are notified first and only once.
+        """
+        mock_iter_subscribers.return_value = iter([1, 2])
+        mock_get_course_preferences.return_value = {2: PreferenceOptions.ALL_POSTS}
+
+        notify_users(*self.notify_users_args, context={})
+
+        self.assertEqual(
+            mock_send_email_notification.call_args_list,
+            [
+                call(*self.notify_users_args, 2, {}),
+                call(*self.notify_users_args, 1, {}),
+            ],
         )
 
     def test_notify_users_invalid_object_type(self):
@@ -297,112 +554,217 @@ class TestNotifyUsers(TestCase):
                 context={},
             )
 
-    @get_user_mock
-    @get_staff_subscribers_mock
-    @get_subscribers_mock
+    @get_course_preferences_mock
+    @iter_subscribers_mock
     @send_email_notification_mock
     @handle_digests_mock
-    def test_notify_users_user_does_not_exist(
+    @data(
+        PreferenceOptions.NONE,
+        PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+        PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
+    )
+    def test_notify_users_user_preference_options(
         self,
+        preference_option: PreferenceOptions,
         mock_handle_digests: Mock,
         mock_send_email_notification: Mock,
-        mock_get_subscribers: Mock,
-        mock_get_staff_subscribers: Mock,
-        mock_get_user: Mock,
+        mock_iter_subscribers: Mock,
+        mock_get_course_preferences: Mock,
     ):
         """
-        Check `notify_users` behavior when user does not exist.
+        Check `notify_users` behavior for different user preference options.
+
+        When preference_option is NONE, ALL_POSTS_DAILY_DIGEST or ALL_POSTS_WEEKLY_DIGEST,
+        the user should not be notified, even if they follow the thread.
 
         Expected result:
             - The `send_email_notification` task is not called.
             - A digest is created for all staff subscribers.
         """
-        mock_get_subscribers.return_value = set()
-        mock_get_staff_subscribers.return_value = set([1])
-        mock_get_user.side_effect = User.DoesNotExist
+        mock_iter_subscribers.return_value = iter([1])
+        mock_get_course_preferences.return_value = {1: preference_option}
 
-        notify_users(
-            thread_id="test-thread_id",
-            discussion={},
-            course_id="test-course_id",
-            body="test-body",
-            title="test-title",
-            url="test-url/",
-            author_id="test-author_id",
-            author_username="test-author_username",
-            author_email="test@author_email.com",
-            object_type=ForumObject.THREAD,
-            context={},
-        )
+        notify_users(*self.notify_users_args, context={})
 
         mock_send_email_notification.assert_not_called()
         mock_handle_digests.assert_called()
 
-    @get_user_mock
-    @get_forum_mock
-    @get_staff_subscribers_mock
-    @get_subscribers_mock
+    @get_course_preferences_mock
+    @iter_subscribers_mock
+    @send_email_notification_mock
+    @handle_digests_mock
+    def test_notify_users_following_preference(
+        self,
+        mock_handle_digests: Mock,
+        mock_send_email_notification: Mock,
+        mock_iter_subscribers: Mock,
+        mock_get_course_preferences: Mock,
+    ):
+        """
+        Check `notify_users` behavior for users that only follow some posts.
+
+        Expected result:
+            - Only the users following the thread are notified.
+        """
+        mock_iter_subscribers.return_value = iter([1])
+        mock_get_course_preferences.return_value = {
+            1: PreferenceOptions.ONLY_POSTS_IM_FOLLOWING,
+            2: PreferenceOptions.ONLY_POSTS_IM_FOLLOWING,
+        }
+
+        notify_users(*self.notify_users_args, context={})
+
+        mock_send_email_notification.assert_called_once_with(
+            *self.notify_users_args, 1, {}
+        )
+        mock_handle_digests.assert_called()
+
+    @override_settings(FORUM_NOTIFIER_EVENT_REFERENCES=True)
+    @patch(f"{TASKS_MODULE_PATH}._create_event")
+    @patch(f"{TASKS_MODULE_PATH}.send_event_notification.delay")
+    @patch(f"{TASKS_MODULE_PATH}.send_event_notification_batch.delay")
+    @patch(f"{TASKS_MODULE_PATH}.handle_event_digests.delay")
+    @get_course_preferences_mock
+    @iter_subscribers_mock
     @send_email_notification_mock
     @handle_digests_mock
     @data(
-        PreferenceOptions.NONE,
-        PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
-        PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
+        (0, [call(7, 1, {}), call(7, 2, {}), call(7, 3, {})], []),
+        (2, [], [call(7, [1, 2], {}), call(7, [3], {})]),
     )
-    def test_notify_users_user_preference_options(
+    @unpack
+    def test_notify_users_event_references(
         self,
-        preference_option: PreferenceOptions,
+        batch_size: int,
+        expected_calls: list,
+        expected_batch_calls: list,
         mock_handle_digests: Mock,
         mock_send_email_notification: Mock,
-        mock_get_subscribers: Mock,
-        mock_get_staff_subscribers: Mock,
-        mock_get_forum_notification_preference: Mock,
-        mock_get_user: Mock,
+        mock_iter_subscribers: Mock,
+        mock_get_course_preferences: Mock,
+        mock_handle_event_digests: Mock,
+        mock_send_event_notification_batch: Mock,
+        mock_send_event_notification: Mock,
+        mock_create_event: Mock,
     ):
         """
-        Check `notify_users` behavior for different user preference options.
+        Check `notify_users` behavior when the tasks receive event references.
+
+        Expected result:
+            - The forum update is stored once with the simplified body.
+            - The notification and digest tasks only receive the event id.
+        """
+        mock_iter_subscribers.return_value = iter([1, 2, 3])
+        mock_get_course_preferences.return_value = {}
+        mock_create_event.return_value.id = 7
+
+        with override_settings(FORUM_NOTIFIER_NOTIFICATION_BATCH_SIZE=batch_size):
+            notify_users(*self.notify_users_args, context={})
+
+        mock_create_event.assert_called_once_with(*self.notify_users_args)
+        self.assertEqual(expected_calls, mock_send_event_notification.call_args_list)
+        self.assertEqual(expected_batch_calls, mock_send_event_notification_batch.call_args_list)
+        mock_handle_event_digests.assert_called_once_with(7)
+        mock_send_email_notification.assert_not_called()
+        mock_handle_digests.assert_not_called()
 
-        When preference_option is NONE, ALL_POSTS_DAILY_DIGEST or ALL_POSTS_WEEKLY_DIGEST,
-        the user should not be notified.
+
+class TestEventReferences(DjangoTestCase):
+    """Test case for the tasks that receive a reference to a stored forum update."""
+
+    def setUp(self):
+        self.event = create_event(discussion={"id": "test-discussion-id"})
+        self.users = create_users(2)
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none", Mock())
+    @patch(f"{TASKS_MODULE_PATH}.get_user_preference", Mock(return_value="en"))
+    @patch(f"{TASKS_MODULE_PATH}.send_forum_email_notification")
+    def test_send_event_notification(self, mock_send_forum_email_notification: Mock):
+        """
+        Test that the notification of a stored forum update is sent.
 
         Expected result:
-            - The `send_email_notification` task is not called.
-            - A digest is created for all staff subscribers.
+            - The email is rendered with the stored forum update.
         """
-        mock_get_subscribers.return_value = set([])
-        mock_get_staff_subscribers.return_value = set([1])
-        mock_get_user.return_value = Mock(spec=User, id=1, email="test@user-email.com")
-        mock_get_forum_notification_preference.return_value = Mock(
-            spec=ForumNotificationPreference,
-            preference=preference_option,
-        )
+        send_event_notification(self.event.id, self.users[0].id, {})
 
-        notify_users(
-            thread_id="test-thread_id",
-            discussion={},
-            course_id="test-course_id",
-            body="test-body",
-            title="test-title",
-            url="test-url/",
-            author_id="test-author_id",
-            author_username="test-author_username",
-            author_email="test@author_email.com",
-            object_type=ForumObject.THREAD,
-            context={},
+        mock_send_forum_email_notification.assert_called_once_with(
+            recipient=Recipient(self.users[0].id, self.users[0].email),
+            language="en",
+            user_context=ANY,
+        )
+        user_context = mock_send_forum_email_notification.call_args.kwargs["user_context"]
+        self.assertEqual("test-body", user_context["body"])
+        self.assertEqual("course-v1:edX+Test+2024", user_context["course_id"])
+        self.assertEqual(
+            "https://example.com/discussions/course-v1:edX+Test+2024/posts/test-thread-id",
+            user_context["url"],
         )
 
-        mock_send_email_notification.assert_not_called()
-        mock_handle_digests.assert_called()
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none", Mock())
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences", Mock(return_value={}))
+    @patch(f"{TASKS_MODULE_PATH}.send_forum_email_notification")
+    def test_send_event_notification_batch(self, mock_send_forum_email_notification: Mock):
+        """
+        Test that the notification of a stored forum update is sent to a batch of users.
+
+        Expected result:
+            - Every user of the batch is notified.
+        """
+        send_event_notification_batch(self.event.id, [user.id for user in self.users], {})
 
+        self.assertEqual(2, mock_send_forum_email_notification.call_count)
 
-class TestHandleDigests(TestCase):
+    @patch(f"{TASKS_MODULE_PATH}.send_forum_email_notification")
+    def test_send_event_notification_missing_event(self, mock_send_forum_email_notification: Mock):
+        """
+        Test that nothing is sent when the forum update no longer exists.
+
+        Expected result:
+            - No email is sent.
+        """
+        send_event_notification(self.event.id + 1, self.users[0].id, {})
+        send_event_notification_batch(self.event.id + 1, [self.users[0].id], {})
+
+        mock_send_forum_email_notification.assert_not_called()
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_preferences")
+    def test_handle_event_digests(self, mock_get_course_preferences: Mock):
+        """
+        Test that a stored forum update is appended to the digests.
+
+        Expected result:
+            - The digest entries reference the stored forum update.
+            - No other forum update is stored.
+        """
+        mock_get_course_preferences.return_value = {
+            self.users[0].id: PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+            self.users[1].id: PreferenceOptions.ALL_POSTS,
+        }
+
+        handle_event_digests(self.event.id)
+
+        self.assertEqual(1, ForumNotificationEvent.objects.count())
+        self.assertEqual(
+            [self.users[0].id],
+            list(
+                ForumNotificationDigestEntry.objects.filter(event=self.event).values_list(
+                    "digest__user_id", flat=True
+                )
+            ),
+        )
+
+
+class TestHandleDigests(DjangoTestCase):
     """Test case for `handle_digests` task."""
 
+    get_course_preferences_mock = patch(f"{TASKS_MODULE_PATH}.get_course_preferences")
+
     def setUp(self):
         self.handle_digest_args = {
             "thread_id": "test-thread-id",
             "discussion": {},
-            "course_id": "test-course-id",
+            "course_id": "course-v1:edX+Test+2024",
             "body": "<p>test-body<p>",
             "title": "test-title",
             "url": "https://example.com/post",
@@ -411,50 +773,192 @@ class TestHandleDigests(TestCase):
             "author_email": "test@author-email.com",
             "object_type": ForumObject.THREAD,
         }
+        self.users = create_users(4)
 
-    @patch(f"{TASKS_MODULE_PATH}.ForumNotificationPreference.objects.filter")
-    @patch(f"{TASKS_MODULE_PATH}.ForumNotificationDigest.objects.get_or_create")
-    def test_handle_digests(
-        self,
-        mock_get_or_create: Mock,
-        mock_filter: Mock,
-    ):
+    @get_course_preferences_mock
+    def test_handle_digests(self, mock_get_course_preferences: Mock):
         """
-        Test `handle_digests` behavior when digest exists.
+        Test `handle_digests` behavior for users with and without digests.
 
         Expected result:
             - A digest is created for each user with a digest preference.
+            - The digest type is updated when the user changed the digest frequency.
+            - The forum update is stored once and appended to every digest.
         """
-        user_mock = Mock()
-        preference_mock = Mock()
-        preference_mock.user = user_mock
-        mock_filter.return_value.select_related.return_value = [preference_mock]
-        digest_mock = Mock(threads_json="[]")
-        mock_get_or_create.return_value = (digest_mock, True)
+        course_id = self.handle_digest_args["course_id"]
+        mock_get_course_preferences.return_value = {
+            self.users[0].id: PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+            self.users[1].id: PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
+            self.users[2].id: PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
+            self.users[3].id: PreferenceOptions.ALL_POSTS,
+        }
+        ForumNotificationDigest.objects.create(
+            user=self.users[1],
+            course_id=course_id,
+            digest_type=PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+        )
 
         handle_digests(**self.handle_digest_args)
 
-        mock_filter.assert_called_once_with(
-            preference__in=(
-                PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
-                PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
-            ),
-            course_id=self.handle_digest_args["course_id"],
-        )
-        mock_get_or_create.assert_called_once_with(
-            user=user_mock,
-            course_id=self.handle_digest_args["course_id"],
-            defaults={
-                "threads_json": "[]",
-                "digest_type": preference_mock.preference,
+        self.assertEqual(
+            dict(ForumNotificationDigest.objects.values_list("user_id", "digest_type")),
+            {
+                self.users[0].id: PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+                self.users[1].id: PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
+                self.users[2].id: PreferenceOptions.ALL_POSTS_WEEKLY_DIGEST,
             },
         )
-        digest_mock.save.assert_called_once()
+        event = ForumNotificationEvent.objects.get()
+        self.assertEqual(event.body, self.handle_digest_args["body"])
+        self.assertEqual(
+            set(
+                ForumNotificationDigestEntry.objects.filter(event=event).values_list(
+                    "digest__user_id", flat=True
+                )
+            ),
+            {self.users[0].id, self.users[1].id, self.users[2].id},
+        )
+        self.assertFalse(ForumNotificationDigest.objects.filter(has_pending=False).exists())
+        new_digest = ForumNotificationDigest.objects.get(user=self.users[0])
+        self.assertAlmostEqual(
+            new_digest.created + timedelta(days=1),
+            new_digest.next_due_at,
+            delta=timedelta(seconds=5),
+        )
+
+    @get_course_preferences_mock
+    def test_handle_digests_constant_queries(self, mock_get_course_preferences: Mock):
+        """
+        Test that `handle_digests` doesn't run more queries with more digest users.
+
+        Expected result:
+            - The number of queries is the same for 1 and 4 digest users.
+        """
+        mock_get_course_preferences.return_value = {
+            self.users[0].id: PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+        }
+        with CaptureQueriesContext(connection) as single_user_queries:
+            handle_digests(**self.handle_digest_args)
+
+        mock_get_course_preferences.return_value = {
+            user.id: PreferenceOptions.ALL_POSTS_DAILY_DIGEST for user in self.users
+        }
+        with CaptureQueriesContext(connection) as many_users_queries:
+            handle_digests(**self.handle_digest_args)
+
+        self.assertEqual(len(single_user_queries), len(many_users_queries))
+        self.assertEqual(5, ForumNotificationDigestEntry.objects.count())
+
+    @get_course_preferences_mock
+    def test_handle_digests_no_digest_users(self, mock_get_course_preferences: Mock):
+        """
+        Test `handle_digests` behavior when no user has a digest preference.
+
+        Expected result:
+            - The forum update is not stored.
+        """
+        mock_get_course_preferences.return_value = {
+            self.users[0].id: PreferenceOptions.ALL_POSTS,
+        }
+
+        handle_digests(**self.handle_digest_args)
+
+        self.assertFalse(ForumNotificationEvent.objects.exists())
+        self.assertFalse(ForumNotificationDigest.objects.exists())
+
+
+class TestHandleDigestsConcurrency(TransactionTestCase):
+    """Concurrency stress test for `handle_digests` task."""
+
+    workers = 8
+    events_per_worker = 5
+
+    def setUp(self):
+        self.course_id = "course-v1:edX+Test+2024"
+        self.users = create_users(10)
+
+    def _handle_digests(self, worker):
+        """Append the forum updates of a worker, as a Celery worker would do."""
+        try:
+            for index in range(self.events_per_worker):
+                handle_digests(
+                    thread_id=f"thread-{worker}-{index}",
+                    discussion={},
+                    course_id=self.course_id,
+                    body="<p>test-body<p>",
+                    title="test-title",
+                    url="https://example.com/post",
+                    author_id="test-author-id",
+                    author_username="test-username",
+                    author_email="test@author-email.com",
+                    object_type=ForumObject.THREAD,
+                )
+        finally:
+            connection.close()
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_preferences")
+    def test_concurrent_handle_digests(self, mock_get_course_preferences: Mock):
+        """
+        Check that no forum update is lost when several workers append to the same digests.
+
+        Expected result:
+            - A single digest is created per user.
+            - Every digest has an entry for every forum update.
+        """
+        mock_get_course_preferences.return_value = {
+            user.id: PreferenceOptions.ALL_POSTS_DAILY_DIGEST for user in self.users
+        }
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self._handle_digests, range(self.workers)))
+
+        expected_entries = self.workers * self.events_per_worker
+        self.assertEqual(len(self.users), ForumNotificationDigest.objects.count())
+        self.assertEqual(expected_entries, ForumNotificationEvent.objects.count())
+        for digest in ForumNotificationDigest.objects.all():
+            self.assertEqual(expected_entries, digest.entries.count())
+
+
+class TestSendDigestBatchConcurrency(DigestTestMixin, TransactionTestCase):
+    """Concurrency stress test for `send_digest_batch` task."""
+
+    workers = 8
+
+    def setUp(self):
+        self.set_up_digests(users_count=10, has_pending=False)
+
+    def _send_digest_batch(self, worker):  # pylint: disable=unused-argument
+        """Send every digest, as a Celery worker of a redundant scheduler would do."""
+        try:
+            send_digest_batch([digest.id for digest in self.digests], {})
+        finally:
+            connection.close()
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none", Mock())
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences", Mock(return_value={}))
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_concurrent_send_digest_batch(self, mock_send_digest_email: Mock):
+        """
+        Check that no digest is sent twice when several workers send the same digests.
+
+        Expected result:
+            - Each digest is sent once.
+            - No lease is left behind.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self._send_digest_batch, range(self.workers)))
+
+        self.assertEqual(len(self.digests), mock_send_digest_email.call_count)
+        self.assertFalse(ForumNotificationDigestEntry.objects.exists())
+        self.assertFalse(
+            ForumNotificationDigest.objects.filter(lease_token__isnull=False).exists()
+        )
 
 
 class TestSendDigest(TestCase):
     """Test cases for `send_digest` task."""
 
+    @patch(f"{TASKS_MODULE_PATH}._claim_digests", Mock(return_value=0))
     @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
     @patch(f"{TASKS_MODULE_PATH}.ForumNotificationDigest.objects.get")
     def test_send_digest_no_digest(
@@ -473,13 +977,63 @@ class TestSendDigest(TestCase):
 
         send_digest_email_mock.assert_not_called()
 
+    @patch(f"{TASKS_MODULE_PATH}._claim_digests", Mock(return_value=1))
+    @patch(f"{TASKS_MODULE_PATH}._get_digest_items", Mock(return_value={}))
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    @patch(f"{TASKS_MODULE_PATH}.ForumNotificationDigest.objects.get")
+    def test_send_digest_no_entries(
+        self, mock_get_digest: Mock, send_digest_email_mock: Mock
+    ):
+        """
+        Check `send_digest` behavior when the digest was already sent.
+
+        Expected result:
+            - No email is sent and only the lease is released.
+        """
+        digest_mock = Mock(last_sent=None)
+        mock_get_digest.return_value = digest_mock
+
+        send_digest("test-digest-id", {})
+
+        send_digest_email_mock.assert_not_called()
+        self.assertIsNone(digest_mock.last_sent)
+        self.assertIsNone(digest_mock.lease_token)
+        digest_mock.save.assert_called_once_with(
+            update_fields=["lease_token", "lease_expires_at", "has_pending", "modified"]
+        )
+
+    @patch(f"{TASKS_MODULE_PATH}._claim_digests", Mock(return_value=0))
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    @patch(f"{TASKS_MODULE_PATH}.ForumNotificationDigest.objects.get")
+    def test_send_digest_claimed(
+        self, mock_get_digest: Mock, send_digest_email_mock: Mock
+    ):
+        """
+        Check `send_digest` behavior when the digest is claimed by another worker.
+
+        Expected result:
+            - No email is sent and the digest is not updated.
+        """
+        digest_mock = Mock()
+        mock_get_digest.return_value = digest_mock
+
+        send_digest("test-digest-id", {})
+
+        send_digest_email_mock.assert_not_called()
+        digest_mock.save.assert_not_called()
+
     @override_settings(LMS_ROOT_URL="https://example.com")
+    @patch(f"{TASKS_MODULE_PATH}._claim_digests", Mock(return_value=1))
     @patch(f"{TASKS_MODULE_PATH}.ForumNotificationDigest.objects.get")
     @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none")
     @patch(f"{TASKS_MODULE_PATH}.get_user_preference")
     @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    @patch(f"{TASKS_MODULE_PATH}.ForumNotificationDigestEntry.objects.filter")
+    @patch(f"{TASKS_MODULE_PATH}._get_digest_items")
     def test_send_digest(
         self,
+        mock_get_digest_items: Mock,
+        mock_filter_entries: Mock,
         mock_send_digest_email: Mock,
         mock_get_user_preference: Mock,
         mock_get_course: Mock,
@@ -495,16 +1049,18 @@ class TestSendDigest(TestCase):
         digest_id = "test-digest-id"
         context = {}
         user_mock = Mock(id=1, email="test@user-email.com")
-        digest_mock = Mock()
+        digest_mock = Mock(digest_type=PreferenceOptions.ALL_POSTS_DAILY_DIGEST)
         digest_mock.user = user_mock
-        digest_mock.threads_json = json.dumps([{"body": "<p>test-body<p>"}])
         mock_get_digest.return_value = digest_mock
+        mock_get_digest_items.return_value = {
+            digest_mock.id: ([{"body": "test-body"}], [1], 2)
+        }
         mock_get_course.return_value = Mock(display_name="test-course-name")
         mock_get_user_preference.return_value = "en"
 
         send_digest(digest_id, context)
 
-        mock_get_digest.assert_called_once_with(id=digest_id)
+        mock_get_digest.assert_called_once_with(id=digest_id, lease_token=ANY)
         mock_get_course.assert_called_once_with(digest_mock.course_id)
         mock_get_user_preference.assert_called_once_with(user_mock, object)
         mock_send_digest_email.assert_called_once_with(
@@ -515,6 +1071,7 @@ class TestSendDigest(TestCase):
                 "course_id": digest_mock.course_id,
                 "course_name": "test-course-name",
                 "threads": [{"body": "test-body"}],
+                "more_count": 2,
                 "forum_notifier_url": (
                     f"https://example.com/courses/{digest_mock.course_id}/"
                     "instructor#view-forum_notifier"
@@ -523,4 +1080,379 @@ class TestSendDigest(TestCase):
             },
         )
         self.assertIsNotNone(digest_mock.last_sent)
-        self.assertEqual(digest_mock.threads_json, "[]")
+        self.assertEqual(digest_mock.last_sent + timedelta(days=1), digest_mock.next_due_at)
+        mock_get_digest_items.assert_called_once_with([digest_mock.id])
+        mock_filter_entries.assert_called_once_with(id__in=[1])
+        mock_filter_entries.return_value.delete.assert_called_once()
+        self.assertIsNone(digest_mock.lease_token)
+        self.assertIsNone(digest_mock.lease_expires_at)
+        self.assertIsInstance(digest_mock.has_pending, Exists)
+        digest_mock.save.assert_called_once_with(
+            update_fields=[
+                "lease_token",
+                "lease_expires_at",
+                "has_pending",
+                "modified",
+                "last_sent",
+                "next_due_at",
+            ]
+        )
+
+
+class TestSendDigestClaim(DigestTestMixin, DjangoTestCase):
+    """Test cases for `send_digest` when another worker sends the digest."""
+
+    def setUp(self):
+        self.set_up_digests(users_count=1)
+        self.digest = self.digests[0]
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none", Mock())
+    @patch(f"{TASKS_MODULE_PATH}.get_user_preference", Mock(return_value=None))
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_sent_before_claim(self, mock_send_digest_email: Mock):
+        """
+        Check `send_digest` behavior when another worker sends the digest right before the claim.
+
+        Expected result:
+            - The digest is sent once.
+            - The `last_sent` and `next_due_at` of the sent digest are kept.
+        """
+        claim_digests = _claim_digests
+
+        def claim_after_other_worker(digest_ids, lease_token):
+            with patch(f"{TASKS_MODULE_PATH}._claim_digests", claim_digests):
+                send_digest(self.digest.id, {})
+            return claim_digests(digest_ids, lease_token)
+
+        with patch(f"{TASKS_MODULE_PATH}._claim_digests", claim_after_other_worker):
+            send_digest(self.digest.id, {})
+
+        mock_send_digest_email.assert_called_once()
+        self.digest.refresh_from_db()
+        self.assertAlmostEqual(timezone.now(), self.digest.last_sent, delta=timedelta(seconds=5))
+        self.assertEqual(self.digest.last_sent + timedelta(days=1), self.digest.next_due_at)
+        self.assertIsNone(self.digest.lease_token)
+        self.assertFalse(self.digest.has_pending)
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none", Mock())
+    @patch(f"{TASKS_MODULE_PATH}.get_user_preference", Mock(return_value=None))
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_enqueued_again_after_sent(self, mock_send_digest_email: Mock):
+        """
+        Check `send_digest` behavior when the digest is enqueued again after it was sent.
+
+        Expected result:
+            - The digest is not sent again before it is due, even with new items.
+            - The new items are kept for the next digest.
+        """
+        send_digest(self.digest.id, {})
+        entry = ForumNotificationDigestEntry.objects.create(
+            digest=self.digest, event=self.event
+        )
+        ForumNotificationDigest.objects.filter(id=self.digest.id).update(has_pending=True)
+
+        send_digest(self.digest.id, {})
+        send_digest_batch([self.digest.id], {})
+
+        mock_send_digest_email.assert_called_once()
+        self.assertTrue(ForumNotificationDigestEntry.objects.filter(id=entry.id).exists())
+        self.digest.refresh_from_db()
+        self.assertTrue(self.digest.has_pending)
+
+
+@ddt
+class TestSendDigestBatch(DigestTestMixin, DjangoTestCase):
+    """Test cases for `send_digest_batch` task."""
+
+    def setUp(self):
+        self.set_up_digests()
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none")
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences")
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_batch(
+        self,
+        mock_send_digest_email: Mock,
+        mock_get_language_preferences: Mock,
+        mock_get_course: Mock,
+    ):
+        """
+        Check `send_digest_batch` behavior for several digests.
+
+        Expected result:
+            - Each digest is sent to its user with its language preference.
+            - The course overview is fetched once for the batch.
+            - The sent entries are deleted and `last_sent` is updated.
+            - The sent digests are no longer pending, and are due in a day.
+            - Digests out of the batch are not touched.
+        """
+        mock_get_course.return_value = Mock(display_name="test-course-name")
+        mock_get_language_preferences.return_value = {self.users[0].id: "es"}
+
+        send_digest_batch([self.digests[0].id, self.digests[1].id], {})
+
+        mock_get_course.assert_called_once()
+        mock_send_digest_email.assert_has_calls(
+            [
+                call(
+                    recipient=Recipient(self.users[0].id, self.users[0].email),
+                    language="es",
+                    user_context=ANY,
+                ),
+                call(
+                    recipient=Recipient(self.users[1].id, self.users[1].email),
+                    language=None,
+                    user_context=ANY,
+                ),
+            ],
+            any_order=True,
+        )
+        user_context = mock_send_digest_email.call_args.kwargs["user_context"]
+        self.assertEqual("test-body", user_context["threads"][0]["body"])
+        self.assertEqual(
+            [self.digests[2].id],
+            list(ForumNotificationDigestEntry.objects.values_list("digest_id", flat=True)),
+        )
+        self.assertEqual(
+            {self.digests[0].id, self.digests[1].id},
+            set(
+                ForumNotificationDigest.objects.exclude(
+                    last_sent=digest_never_sent()
+                ).values_list("id", flat=True)
+            ),
+        )
+        self.assertEqual(
+            [self.digests[2].id],
+            list(
+                ForumNotificationDigest.objects.filter(has_pending=True).values_list(
+                    "id", flat=True
+                )
+            ),
+        )
+        sent_digest = ForumNotificationDigest.objects.get(id=self.digests[0].id)
+        self.assertEqual(sent_digest.last_sent + timedelta(days=1), sent_digest.next_due_at)
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none")
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences")
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_batch_failed_email(
+        self,
+        mock_send_digest_email: Mock,
+        mock_get_language_preferences: Mock,
+        mock_get_course: Mock,
+    ):
+        """
+        Check `send_digest_batch` behavior when an email fails to be sent.
+
+        Expected result:
+            - The other digests of the batch are sent.
+            - The entries of the failed digest are kept for the next digest.
+            - The failed digest is still pending.
+        """
+        mock_get_course.return_value = Mock(display_name="test-course-name")
+        mock_get_language_preferences.return_value = {}
+        failed_recipient = Recipient(self.users[0].id, self.users[0].email)
+
+        def send_digest_email(recipient, **kwargs):
+            if recipient == failed_recipient:
+                raise Exception("test-error")  # pylint: disable=broad-exception-raised
+
+        mock_send_digest_email.side_effect = send_digest_email
+
+        send_digest_batch([digest.id for digest in self.digests], {})
+
+        self.assertEqual(3, mock_send_digest_email.call_count)
+        self.assertEqual(
+            [self.digests[0].id],
+            list(ForumNotificationDigestEntry.objects.values_list("digest_id", flat=True)),
+        )
+        failed_digest = ForumNotificationDigest.objects.get(id=self.digests[0].id)
+        self.assertEqual(digest_never_sent(), failed_digest.last_sent)
+        self.assertTrue(failed_digest.has_pending)
+
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_batch_no_digests(self, mock_send_digest_email: Mock):
+        """
+        Check `send_digest_batch` behavior when the digests do not exist.
+
+        Expected result:
+            - No email is sent.
+        """
+        send_digest_batch([0], {})
+
+        mock_send_digest_email.assert_not_called()
+
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none")
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences")
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_batch_twice(
+        self,
+        mock_send_digest_email: Mock,
+        mock_get_language_preferences: Mock,
+        mock_get_course: Mock,
+    ):
+        """
+        Check `send_digest_batch` behavior when a digest is enqueued twice.
+
+        Expected result:
+            - The digest is only sent once.
+        """
+        mock_get_course.return_value = Mock(display_name="test-course-name")
+        mock_get_language_preferences.return_value = {}
+
+        send_digest_batch([self.digests[0].id], {})
+        send_digest_batch([self.digests[0].id], {})
+
+        mock_send_digest_email.assert_called_once()
+
+    @data(
+        (timedelta(minutes=5), False),
+        (timedelta(minutes=-5), True),
+    )
+    @unpack
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none")
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences")
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_batch_leased(
+        self,
+        lease_expires_in: timedelta,
+        sent: bool,
+        mock_send_digest_email: Mock,
+        mock_get_language_preferences: Mock,
+        mock_get_course: Mock,
+    ):
+        """
+        Check `send_digest_batch` behavior when a digest is claimed by another worker.
+
+        Expected result:
+            - The digest is skipped while the lease is active.
+            - The digest is sent once the lease expired.
+            - The other digests of the batch are sent and their leases released.
+        """
+        mock_get_course.return_value = Mock(display_name="test-course-name")
+        mock_get_language_preferences.return_value = {}
+        ForumNotificationDigest.objects.filter(id=self.digests[0].id).update(
+            lease_token=uuid4(), lease_expires_at=timezone.now() + lease_expires_in
+        )
+
+        send_digest_batch([digest.id for digest in self.digests], {})
+
+        self.assertEqual(2 + sent, mock_send_digest_email.call_count)
+        self.assertEqual(
+            not sent,
+            ForumNotificationDigestEntry.objects.filter(digest=self.digests[0]).exists(),
+        )
+        self.assertEqual(
+            1 - sent,
+            ForumNotificationDigest.objects.filter(lease_token__isnull=False).count(),
+        )
+
+    @override_settings(FORUM_NOTIFIER_DIGEST_MAX_ITEMS=2)
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none")
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences")
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_batch_compacted(
+        self,
+        mock_send_digest_email: Mock,
+        mock_get_language_preferences: Mock,
+        mock_get_course: Mock,
+    ):
+        """
+        Check `send_digest_batch` behavior for a digest over the item cap.
+
+        Expected result:
+            - Only the most recent items are sent, with the count of the rest.
+            - Every entry of the digest is deleted.
+        """
+        mock_get_course.return_value = Mock(display_name="test-course-name")
+        mock_get_language_preferences.return_value = {}
+        events = [create_event(thread_id=f"test-thread-id-{index}") for index in range(2)]
+        ForumNotificationDigestEntry.objects.bulk_create(
+            ForumNotificationDigestEntry(digest=self.digests[0], event=event)
+            for event in events
+        )
+
+        send_digest_batch([self.digests[0].id], {})
+
+        user_context = mock_send_digest_email.call_args.kwargs["user_context"]
+        self.assertEqual(
+            ["test-thread-id-0", "test-thread-id-1"],
+            [thread["thread_id"] for thread in user_context["threads"]],
+        )
+        self.assertEqual(1, user_context["more_count"])
+        self.assertFalse(
+            ForumNotificationDigestEntry.objects.filter(digest=self.digests[0]).exists()
+        )
+
+    @override_settings(FORUM_NOTIFIER_DIGEST_MAX_ITEMS=1)
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none")
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences")
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_batch_collapsed_replies(
+        self,
+        mock_send_digest_email: Mock,
+        mock_get_language_preferences: Mock,
+        mock_get_course: Mock,
+    ):
+        """
+        Check `send_digest_batch` behavior for the replies of a thread over the item cap.
+
+        The `thread_id` of a response or comment is its own id, and its thread is
+        the id of its discussion, as sent by the forum signal handlers.
+
+        Expected result:
+            - The replies are collapsed by their thread into a single item.
+            - The collapsed item links to the thread.
+        """
+        mock_get_course.return_value = Mock(display_name="test-course-name")
+        mock_get_language_preferences.return_value = {}
+        ForumNotificationDigestEntry.objects.all().delete()
+        events = [
+            create_event(
+                thread_id=f"test-reply-id-{index}",
+                discussion={"id": "test-thread-id"},
+                object_type=object_type,
+            )
+            for index, object_type in enumerate(
+                (ForumObject.RESPONSE, ForumObject.COMMENT, ForumObject.RESPONSE)
+            )
+        ]
+        ForumNotificationDigestEntry.objects.bulk_create(
+            ForumNotificationDigestEntry(digest=self.digests[0], event=event)
+            for event in events
+        )
+
+        send_digest_batch([self.digests[0].id], {})
+
+        user_context = mock_send_digest_email.call_args.kwargs["user_context"]
+        (thread,) = user_context["threads"]
+        self.assertEqual("test-reply-id-2", thread["thread_id"])
+        self.assertEqual("test-thread-id", thread["post_id"])
+        self.assertEqual((2, 1), (thread["responses_count"], thread["comments_count"]))
+        self.assertEqual(0, user_context["more_count"])
+
+    @data(1, 3)
+    @patch(f"{TASKS_MODULE_PATH}.get_course_overview_or_none")
+    @patch(f"{TASKS_MODULE_PATH}.get_language_preferences")
+    @patch(f"{TASKS_MODULE_PATH}.send_digest_email_notification")
+    def test_send_digest_batch_constant_queries(
+        self,
+        batch_size: int,
+        mock_send_digest_email: Mock,  # pylint: disable=unused-argument
+        mock_get_language_preferences: Mock,
+        mock_get_course: Mock,
+    ):
+        """
+        Test that `send_digest_batch` doesn't run more queries with more digests.
+
+        Expected result:
+            - The digests, users and entries are loaded, and the sent digests are
+              reset, in a fixed number of queries.
+        """
+        mock_get_course.return_value = Mock(display_name="test-course-name")
+        mock_get_language_preferences.return_value = {}
+
+        with CaptureQueriesContext(connection) as queries:
+            send_digest_batch([digest.id for digest in self.digests[:batch_size]], {})
+
+        self.assertEqual(6, len(queries))
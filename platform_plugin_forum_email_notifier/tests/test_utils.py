@@ -1,13 +1,69 @@
 """ Unit tests for utils in `platform_plugin_forum_email_notifier` plugin."""
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, call, patch
 
+from bs4 import BeautifulSoup
 from ddt import data, ddt, unpack
+from django.core.cache import cache
+from django.test.utils import override_settings
 
-from platform_plugin_forum_email_notifier.utils import get_staff_subscribers, get_subscribers
+from platform_plugin_forum_email_notifier import utils
+from platform_plugin_forum_email_notifier.models import PreferenceOptions
+from platform_plugin_forum_email_notifier.utils import (
+    ForumObject,
+    TaskBuffer,
+    chunked,
+    compact_digest_entries,
+    delete_orphan_events,
+    get_course_preferences,
+    get_language_preferences,
+    get_memoized_base_email_context,
+    get_simplified_text,
+    get_staff_subscribers,
+    get_subscribers,
+    get_subscribers_cache_stats,
+    invalidate_course_preferences,
+    iter_subscribers,
+    truncate_text,
+)
 
 UTILS_MODULE_PATH = "platform_plugin_forum_email_notifier.utils"
 
+# Forum post bodies, from the ones written with the editor to malformed and unusual html
+HTML_CORPUS = [
+    "",
+    "Plain text without any markup",
+    "<p>Hello <strong>world</strong>!</p>",
+    "<p>a</p>\n\n  <p>b</p>",
+    "<p>First paragraph</p>\r\n<p>Second paragraph</p>\t<p>Third</p>",
+    "<ul>\n  <li>One</li>\n  <li>Two <em>items</em></li>\n</ul>",
+    "<table><tr><td>cell 1</td> <td>cell 2</td></tr></table>",
+    '<p><img src="https://example.com/a.png" alt="an image"/> after the image</p>',
+    '<p>line<br>break<br/>and<br></br>more</p>',
+    '<a href="https://example.com?a=1&amp;b=2">a link</a> &amp; &lt;escaped&gt; &quot;text&quot;',
+    "caf&eacute; &copy; &nbsp;&unknown; &amp &ampx; AT&T a & b",
+    "&#65;&#x42;&#0;&#128;&#129;&#150;&#xD800;&#1114112;&#x1F600;",
+    "<pre>  keep\n   the   spacing  </pre>  \n  <textarea>  \n  </textarea>",
+    "<pre><code>def f():\n    return 1</code></pre>",
+    "<p>text</p><script>var a = '<p>hidden</p>';</script><style>p { color: red; }</style>shown",
+    "<template><p>hidden <b>nested</b></p></template>shown",
+    "<ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp>字</ruby>",
+    "x <!-- a comment --> y",
+    "<!DOCTYPE html><html><head><title>Title</title></head><body><p>Body</p></body></html>",
+    "<?xml version='1.0'?><p>after a processing instruction</p>",
+    "<![CDATA[cdata text]]> and <template><![CDATA[inside a template]]></template>",
+    "<b>x</b",
+    "<p>unclosed <b>bold <i>italic</p> after",
+    "<div><p>mismatched</div> closing</p> tags",
+    "</p>stray end tag<br/>",
+    "<p/>self closed<pre/> text",
+    "Ünïcödé text — with “quotes” and emoji 😀",
+    "<p>" + "A long post. " * 40 + "</p>",
+    "<p>" + "word " * 30 + "</p>" + "<p>" + "x" * 200 + "</p>",
+    " \n ".join(f"<p>Paragraph {number}</p>" for number in range(50)),
+    "<h1>Title</h1>" + "<script>" + "hidden " * 100 + "</script>" + "visible " * 40,
+]
+
 
 @ddt
 class TestUtils(TestCase):
@@ -19,6 +75,12 @@ class TestUtils(TestCase):
         f"{UTILS_MODULE_PATH}.ForumNotificationPreference.objects.filter"
     )
 
+    def setUp(self) -> None:
+        """
+        Set up common test data for each test case.
+        """
+        cache.clear()
+
     @settings_mock
     @utils_mock
     @data(
@@ -82,6 +144,102 @@ class TestUtils(TestCase):
 
         self.assertEqual(response, set())
 
+    @settings_mock
+    @utils_mock
+    @data(1, 4)
+    def test_get_subscribers_multiple_pages(
+        self,
+        max_workers: int,
+        mock_comment_client_utils: Mock,
+        mock_settings: Mock,
+    ):
+        """
+        Test that the function fetches every page of subscriptions.
+
+        Expected result:
+            - Every page is requested once, sequentially or concurrently
+            - The function returns the subscribers of all the pages
+        """
+
+        def perform_request(method, url, params):  # pylint: disable=unused-argument
+            page = params["page"]
+            return {
+                "collection": [{"subscriber_id": str(page)}, {"subscriber_id": "1"}],
+                "num_pages": 3,
+                "page": page,
+            }
+
+        mock_comment_client_utils.perform_request.side_effect = perform_request
+        mock_settings.PREFIX = "test-prefix"
+
+        with override_settings(FORUM_NOTIFIER_SUBSCRIPTIONS_MAX_WORKERS=max_workers):
+            response = get_subscribers("thread-id")
+
+        self.assertEqual(response, {1, 2, 3})
+        self.assertEqual(3, mock_comment_client_utils.perform_request.call_count)
+        mock_comment_client_utils.perform_request.assert_any_call(
+            "get", "test-prefix/threads/thread-id/subscriptions", {"page": 3}
+        )
+
+    @settings_mock
+    @utils_mock
+    def test_iter_subscribers(self, mock_comment_client_utils: Mock, mock_settings: Mock):
+        """
+        Test that the generator yields the subscribers page by page.
+
+        Expected result:
+            - The first subscribers are yielded before the next page is requested
+            - Each subscriber is yielded only once
+        """
+        mock_comment_client_utils.perform_request.side_effect = [
+            {
+                "collection": [{"subscriber_id": "1"}, {"subscriber_id": "2"}],
+                "num_pages": 2,
+                "page": 1,
+            },
+            {
+                "collection": [{"subscriber_id": "2"}, {"subscriber_id": "3"}],
+                "num_pages": 2,
+                "page": 2,
+            },
+        ]
+        mock_settings.PREFIX = "test-prefix"
+
+        subscribers = iter_subscribers("thread-id")
+        first_subscriber = next(subscribers)
+
+        mock_comment_client_utils.perform_request.assert_called_once()
+        self.assertEqual(sorted([first_subscriber, *subscribers]), [1, 2, 3])
+        self.assertEqual(2, mock_comment_client_utils.perform_request.call_count)
+
+    @override_settings(FORUM_NOTIFIER_SUBSCRIBERS_CACHE_TIMEOUT=60)
+    @settings_mock
+    @utils_mock
+    def test_get_subscribers_cached(
+        self, mock_comment_client_utils: Mock, mock_settings: Mock
+    ):
+        """
+        Test that the subscribers of a thread are cached when the cache is enabled.
+
+        Expected result:
+            - The forum service is requested only on the first call
+            - The cache hits and misses are counted
+        """
+        mock_comment_client_utils.perform_request.return_value = {
+            "collection": [{"subscriber_id": "1"}, {"subscriber_id": "2"}],
+            "num_pages": 1,
+            "page": 1,
+        }
+        mock_settings.PREFIX = "test-prefix"
+
+        first_response = get_subscribers("thread-id")
+        second_response = get_subscribers("thread-id")
+
+        self.assertEqual(first_response, {1, 2})
+        self.assertEqual(second_response, {1, 2})
+        mock_comment_client_utils.perform_request.assert_called_once()
+        self.assertEqual(get_subscribers_cache_stats(), {"hits": 1, "misses": 1})
+
     @forum_preference_mock
     def test_multiple_subscribers(self, mock_filter: Mock):
         """
@@ -90,10 +248,11 @@ class TestUtils(TestCase):
         Expected result:
             - The function returns the correct set of subscribers
         """
-        first_mock, second_mock = Mock(), Mock()
-        first_mock.user.id = 1
-        second_mock.user.id = 2
-        mock_filter.return_value = [first_mock, second_mock, first_mock]
+        mock_filter.return_value.values_list.return_value = [
+            (1, PreferenceOptions.ALL_POSTS),
+            (2, PreferenceOptions.ALL_POSTS),
+            (3, PreferenceOptions.ALL_POSTS_DAILY_DIGEST),
+        ]
 
         response = get_staff_subscribers("course_id")
 
@@ -107,8 +266,292 @@ class TestUtils(TestCase):
         Expected result:
             - The function returns an empty set
         """
-        mock_filter.return_value = []
+        mock_filter.return_value.values_list.return_value = []
 
         response = get_staff_subscribers("course_id")
 
         self.assertEqual(response, set())
+
+    @data(
+        ([1, 2, 3, 4, 5], 2, [[1, 2], [3, 4], [5]]),
+        ([1, 2], 5, [[1, 2]]),
+        ([], 3, []),
+    )
+    @unpack
+    def test_chunked(self, items: list, size: int, expected_result: list):
+        """
+        Test that the function splits the items in chunks of the given size.
+
+        Expected result:
+            - The function yields the expected chunks
+        """
+        response = list(chunked(iter(items), size))
+
+        self.assertEqual(response, expected_result)
+
+    @data(0, 10)
+    def test_compact_digest_entries_under_cap(self, max_items: int):
+        """
+        Test that the forum updates of a digest under the cap are only deduplicated.
+
+        Expected result:
+            - Every forum update is kept once, in order.
+        """
+        entries = [
+            (1, "thread-1", ForumObject.THREAD),
+            (2, "thread-1", ForumObject.RESPONSE),
+            (2, "thread-1", ForumObject.RESPONSE),
+            (3, "thread-1", ForumObject.COMMENT),
+        ]
+
+        items, more_count = compact_digest_entries(entries, max_items)
+
+        self.assertEqual([1, 2, 3], [item["event_id"] for item in items])
+        self.assertEqual(0, more_count)
+
+    def test_compact_digest_entries_over_cap(self):
+        """
+        Test that the forum updates of a digest over the cap are compacted.
+
+        Expected result:
+            - The replies of each thread are collapsed into their most recent reply,
+              grouped by the id of their thread.
+            - A single reply is kept as is.
+            - Only the most recent items are kept, and the rest are counted.
+        """
+        entries = [
+            (1, "thread-1", ForumObject.THREAD),
+            (2, "thread-2", ForumObject.THREAD),
+            (3, "thread-1", ForumObject.RESPONSE),
+            (4, "thread-3", ForumObject.RESPONSE),
+            (5, "thread-1", ForumObject.COMMENT),
+            (6, "thread-1", ForumObject.RESPONSE),
+            (6, "thread-1", ForumObject.RESPONSE),
+            (7, "thread-4", ForumObject.THREAD),
+        ]
+
+        items, more_count = compact_digest_entries(entries, 3)
+
+        self.assertEqual(
+            [
+                {"event_id": 4, "responses_count": 0, "comments_count": 0},
+                {"event_id": 6, "responses_count": 2, "comments_count": 1},
+                {"event_id": 7, "responses_count": 0, "comments_count": 0},
+            ],
+            items,
+        )
+        self.assertEqual(2, more_count)
+
+    @patch(f"{UTILS_MODULE_PATH}.ForumNotificationEvent.objects.filter")
+    def test_delete_orphan_events(self, mock_filter: Mock):
+        """
+        Check `delete_orphan_events` behavior.
+
+        Expected result:
+            - Old events without digest entries are deleted.
+        """
+        mock_filter.return_value.exclude.return_value.delete.return_value = (1, {})
+
+        self.assertEqual(1, delete_orphan_events())
+
+        mock_filter.return_value.exclude.return_value.delete.assert_called_once()
+
+    @forum_preference_mock
+    def test_get_course_preferences(self, mock_filter: Mock):
+        """
+        Test that the function returns the preferences of the course keyed by user id.
+
+        Expected result:
+            - The preferences are fetched with a single query
+        """
+        mock_filter.return_value.values_list.return_value = [
+            (1, PreferenceOptions.ALL_POSTS),
+            (2, PreferenceOptions.NONE),
+        ]
+
+        response = get_course_preferences("course_id")
+
+        self.assertEqual(
+            response, {1: PreferenceOptions.ALL_POSTS, 2: PreferenceOptions.NONE}
+        )
+        mock_filter.assert_called_once_with(course_id="course_id")
+        mock_filter.return_value.values_list.assert_called_once_with(
+            "user_id", "preference"
+        )
+
+    @forum_preference_mock
+    def test_get_course_preferences_cached(self, mock_filter: Mock):
+        """
+        Test that the preferences of a course are cached until invalidated.
+
+        Expected result:
+            - The preferences are fetched again only after the invalidation
+        """
+        mock_filter.return_value.values_list.return_value = [
+            (1, PreferenceOptions.ALL_POSTS),
+        ]
+
+        get_course_preferences("course_id")
+        response = get_course_preferences("course_id")
+
+        self.assertEqual(response, {1: PreferenceOptions.ALL_POSTS})
+        mock_filter.assert_called_once()
+
+        invalidate_course_preferences("course_id")
+        get_course_preferences("course_id")
+
+        self.assertEqual(2, mock_filter.call_count)
+
+    @forum_preference_mock
+    def test_get_course_preferences_invalidated_while_querying(
+        self, mock_filter: Mock
+    ):
+        """
+        Test that preferences read before an invalidation are not served after it.
+
+        Expected result:
+            - The preferences are fetched again after the concurrent invalidation
+        """
+
+        def changed_while_querying(*args):
+            invalidate_course_preferences("course_id")
+            return [(1, PreferenceOptions.ALL_POSTS)]
+
+        mock_filter.return_value.values_list.side_effect = changed_while_querying
+        get_course_preferences("course_id")
+        mock_filter.return_value.values_list.side_effect = None
+        mock_filter.return_value.values_list.return_value = [
+            (1, PreferenceOptions.NONE),
+        ]
+
+        response = get_course_preferences("course_id")
+
+        self.assertEqual(response, {1: PreferenceOptions.NONE})
+        self.assertEqual(2, mock_filter.call_count)
+
+    @patch(f"{UTILS_MODULE_PATH}.get_user_preference_model")
+    def test_get_language_preferences(self, mock_get_user_preference_model: Mock):
+        """
+        Test that the function returns the language preferences keyed by user id.
+
+        Expected result:
+            - The preferences of all the users are fetched with a single query
+        """
+        mock_filter = mock_get_user_preference_model.return_value.objects.filter
+        mock_filter.return_value.values_list.return_value = [(1, "en"), (2, "es-419")]
+
+        response = get_language_preferences({1: Mock(), 2: Mock()}.keys())
+
+        self.assertEqual(response, {1: "en", 2: "es-419"})
+        mock_filter.assert_called_once_with(user_id__in=[1, 2], key=object)
+        mock_filter.return_value.values_list.assert_called_once_with("user_id", "value")
+
+    @data(*HTML_CORPUS)
+    def test_get_simplified_text(self, html: str):
+        """
+        Test that the simplified text is the one extracted by BeautifulSoup.
+
+        Expected result:
+            - The text is the same as the truncated `get_text` of the parsed html
+        """
+        text = BeautifulSoup(html, "html.parser").get_text()
+
+        for max_length in (5, 160, 10000):
+            self.assertEqual(
+                get_simplified_text(html, max_length=max_length),
+                truncate_text(text, max_length=max_length),
+            )
+        self.assertEqual(get_simplified_text(html), truncate_text(text))
+
+    @patch(f"{UTILS_MODULE_PATH}.monotonic")
+    @patch(f"{UTILS_MODULE_PATH}.get_base_template_context")
+    @patch(f"{UTILS_MODULE_PATH}.Site.objects.get_current")
+    @override_settings(FORUM_NOTIFIER_BASE_CONTEXT_TIMEOUT=60)
+    def test_get_memoized_base_email_context(
+        self,
+        mock_get_current: Mock,
+        mock_get_base_template_context: Mock,
+        mock_monotonic: Mock,
+    ):
+        """
+        Test that the base email context is built once per site and timeout.
+
+        Expected result:
+            - The context is built again only for another site or once expired.
+            - A copy of the context is returned, so callers can update it.
+        """
+        sites = {1: Mock(id=1), 2: Mock(id=2)}
+        mock_get_base_template_context.side_effect = lambda site: {"site": site.id}
+
+        with patch.dict(utils._BASE_EMAIL_CONTEXTS, clear=True):  # pylint: disable=protected-access
+            for site_id, now in ((1, 100), (1, 159), (2, 159), (1, 160)):
+                mock_get_current.return_value = sites[site_id]
+                mock_monotonic.return_value = now
+                context = get_memoized_base_email_context()
+                context["user"] = "test-user"
+
+        self.assertEqual({"site": 1, "user": "test-user"}, context)
+        self.assertEqual(
+            [call(sites[1]), call(sites[2]), call(sites[1])],
+            mock_get_base_template_context.call_args_list,
+        )
+
+
+class TestTaskBuffer(TestCase):
+    """Test suite for the `TaskBuffer` of deferred Celery tasks."""
+
+    def test_put(self):
+        """
+        Test that the buffered tasks are enqueued by the background thread.
+
+        Expected result:
+            - Every task is enqueued with its arguments, in order.
+        """
+        task = Mock()
+        task_buffer = TaskBuffer(10)
+
+        for index in range(3):
+            self.assertTrue(task_buffer.put(task, index, context=None))
+        task_buffer.join()
+
+        self.assertEqual(
+            [call(0, context=None), call(1, context=None), call(2, context=None)],
+            task.delay.call_args_list,
+        )
+
+    @patch(f"{UTILS_MODULE_PATH}.TaskBuffer._start_thread", Mock())
+    def test_put_full(self):
+        """
+        Test that tasks are dropped once the buffer is full.
+
+        Expected result:
+            - The task over the size of the buffer is not added.
+        """
+        task = Mock()
+        task_buffer = TaskBuffer(2)
+
+        results = [task_buffer.put(task, index) for index in range(3)]
+        task_buffer.drain()
+
+        self.assertEqual([True, True, False], results)
+        self.assertEqual([call(0), call(1)], task.delay.call_args_list)
+
+    @patch(f"{UTILS_MODULE_PATH}.TaskBuffer._start_thread", Mock())
+    def test_drain_broker_error(self):
+        """
+        Test that a task that can't be enqueued doesn't stop the following ones.
+
+        Expected result:
+            - The error is logged and the next task is enqueued.
+        """
+        failing_task = Mock()
+        failing_task.delay.side_effect = ConnectionError
+        task = Mock()
+        task_buffer = TaskBuffer(10)
+        task_buffer.put(failing_task, 1)
+        task_buffer.put(task, 2)
+
+        with self.assertLogs(UTILS_MODULE_PATH, level="ERROR"):
+            task_buffer.drain()
+
+        task.delay.assert_called_once_with(2)
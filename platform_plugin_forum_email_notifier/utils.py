@@ -1,8 +1,28 @@
 """Utilities for the platform_plugin_forum_email_notifier plugin."""
+import atexit
+import logging
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from enum import IntEnum
+from functools import partial
+from html import unescape
+from html.parser import HTMLParser
+from itertools import islice
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from time import monotonic
+from uuid import uuid4
 
-from bs4 import BeautifulSoup
+# The tree builders are exported by bs4.builder when it registers them
+from bs4.builder import HTMLParserTreeBuilder  # pylint: disable=no-name-in-module
+from bs4.dammit import EntitySubstitution
+from django.conf import settings as django_settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from edx_django_utils.monitoring import set_custom_attribute
 
 try:
     from openedx.core.djangoapps.ace_common.template_context import get_base_template_context
@@ -13,7 +33,38 @@ except ImportError:
     comment_client_utils = object
     get_base_template_context = object
 
-from platform_plugin_forum_email_notifier.models import ForumNotificationPreference, PreferenceOptions
+from platform_plugin_forum_email_notifier.edxapp_wrapper.lang_pref import LANGUAGE_KEY
+from platform_plugin_forum_email_notifier.edxapp_wrapper.user_api import get_user_preference_model
+from platform_plugin_forum_email_notifier.models import (
+    ForumNotificationDigestEntry,
+    ForumNotificationEvent,
+    ForumNotificationPreference,
+    PreferenceOptions,
+)
+
+log = logging.getLogger(__name__)
+
+# Age of the forum events without digest entries that are deleted
+ORPHAN_EVENTS_MIN_AGE = timedelta(days=1)
+
+# Signed 64 bits integers, used to store the subscriber ids compactly in the cache
+SUBSCRIBERS_ARRAY_TYPECODE = "q"
+
+# The html rules of BeautifulSoup's html.parser tree builder, followed when extracting
+# the text of a post so that it matches `BeautifulSoup(text, "html.parser").get_text()`
+_HTML_TREE_BUILDER = HTMLParserTreeBuilder()
+HIDDEN_TEXT_TAGS = frozenset(_HTML_TREE_BUILDER.string_containers)
+PRESERVE_WHITESPACE_TAGS = frozenset(_HTML_TREE_BUILDER.preserve_whitespace_tags)
+VOID_TAGS = frozenset(_HTML_TREE_BUILDER.empty_element_tags)
+# The ASCII whitespace of the html standard, which BeautifulSoup strips from text nodes
+ASCII_SPACES = " \n\t\x0c\r"
+
+# Base email context of each site memoized by this process, as {site_id: (expires_at, context)}
+_BASE_EMAIL_CONTEXTS = {}
+
+# Task buffer of this process, created on first use
+_TASK_BUFFER = None
+_TASK_BUFFER_LOCK = Lock()
 
 
 def get_base_email_context() -> dict:
@@ -27,6 +78,28 @@ def get_base_email_context() -> dict:
     return get_base_template_context(site)
 
 
+def get_memoized_base_email_context() -> dict:
+    """
+    Return the base email context, built at most once per site and timeout.
+
+    The context is memoized by the process, so the tasks build it once instead
+    of receiving it from the signal handlers.
+
+    Returns:
+        dict: A copy of the base email context of the current site.
+    """
+    site = Site.objects.get_current()
+    now = monotonic()
+    expires_at, context = _BASE_EMAIL_CONTEXTS.get(site.id, (now, None))
+
+    if expires_at <= now:
+        timeout = getattr(django_settings, "FORUM_NOTIFIER_BASE_CONTEXT_TIMEOUT", 300)
+        context = get_base_template_context(site)
+        _BASE_EMAIL_CONTEXTS[site.id] = (now + timeout, context)
+
+    return dict(context)
+
+
 def truncate_text(text: str, max_length=160, suffix="..."):
     """
     Return a truncated version of the text.
@@ -41,56 +114,468 @@ def truncate_text(text: str, max_length=160, suffix="..."):
     return f"{text[:max_length]}{suffix}"
 
 
-def get_simplified_text(text: str) -> str:
+class _TextLimitReached(Exception):
+    """Raised by the text extractor once it has collected enough text."""
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Collect the visible text of a html string without building a document tree.
+
+    The text nodes are split, collapsed and hidden exactly as BeautifulSoup does
+    with the html.parser tree builder, and the parsing stops as soon as more than
+    `limit` characters of text have been collected.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__(convert_charrefs=False)
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+        self._data = []
+        self._open_tags = []
+        self._hidden_depth = 0
+        self._preserve_depth = 0
+        self._closed_void_tags = []
+
+    @property
+    def text(self) -> str:
+        """Return the text collected so far."""
+        return "".join(self.parts)
+
+    def _end_data(self, visible=None):
+        """
+        Close the current text node and collect it when it is visible.
+
+        Args:
+            visible (bool, optional): Whether the node is visible regardless of the
+                open tags, as CDATA sections are. Defaults to None.
+        """
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data = []
+        if not self._preserve_depth and not data.strip(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+        if visible is None:
+            visible = not self._hidden_depth
+        if visible:
+            self.parts.append(data)
+            self.length += len(data)
+            if self.length > self.limit:
+                raise _TextLimitReached
+
+    def _push_tag(self, tag: str):
+        """Open a tag."""
+        self._open_tags.append(tag)
+        self._hidden_depth += tag in HIDDEN_TEXT_TAGS
+        self._preserve_depth += tag in PRESERVE_WHITESPACE_TAGS
+
+    def _pop_to_tag(self, tag: str):
+        """Close the most recently opened `tag` and the tags opened after it, if any."""
+        if tag not in self._open_tags:
+            return
+        while True:
+            popped = self._open_tags.pop()
+            self._hidden_depth -= popped in HIDDEN_TEXT_TAGS
+            self._preserve_depth -= popped in PRESERVE_WHITESPACE_TAGS
+            if popped == tag:
+                return
+
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        if tag in VOID_TAGS:
+            self._closed_void_tags.append(tag)
+        else:
+            self._push_tag(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._end_data()
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void_tags:
+            self._closed_void_tags.remove(tag)
+            return
+        self._end_data()
+        self._pop_to_tag(tag)
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        self._data.append(unescape(f"&#{name};"))
+
+    def handle_entityref(self, name):
+        self._data.append(EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name, f"&{name}"))
+
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def unknown_decl(self, data):
+        self._end_data()
+        if data.upper().startswith("CDATA["):
+            self._data.append(data[len("CDATA["):])
+            self._end_data(visible=True)
+
+    def close(self):
+        super().close()
+        self._end_data()
+
+
+def get_simplified_text(text: str, max_length=160) -> str:
     """
     Return the simplified text of a html string.
 
-    If the text is longer than 160 characters, it will be truncated.
+    The text is extracted while the html is parsed, which stops as soon as enough
+    text has been collected. If the text is longer than `max_length` characters,
+    it will be truncated.
 
     Args:
         text (str): The html string.
+        max_length (int, optional): The maximum length of the text. Defaults to 160.
 
     Returns:
         str: The simplified text.
     """
-    soup = BeautifulSoup(text, "html.parser")
-    text = soup.get_text()
-    return truncate_text(text)
+    extractor = _TextExtractor(max_length)
+    try:
+        extractor.feed(text)
+        extractor.close()
+    except _TextLimitReached:
+        pass
+    return truncate_text(extractor.text, max_length=max_length)
+
+
+def chunked(iterable, size: int):
+    """
+    Yield successive lists of at most `size` items from an iterable.
+
+    Args:
+        iterable (iterable): The items to split.
+        size (int): The maximum number of items per chunk.
+
+    Yields:
+        list: The next chunk of items.
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def compact_digest_entries(entries, max_items: int):
+    """
+    Compact the forum updates of a digest to at most `max_items` items.
+
+    Duplicated forum updates are dropped. When the digest has more forum updates
+    than `max_items`, the responses and comments of each thread are collapsed into
+    a single item with their counts, and only the `max_items` most recent items
+    are kept.
+
+    Args:
+        entries (list): The `(event_id, post_id, object_type)` of the forum updates,
+            from the oldest to the most recent. The post id of a response or
+            comment is the id of its thread.
+        max_items (int): The maximum number of items. 0 keeps every item.
+
+    Returns:
+        tuple: The items, as dicts with the `event_id` of the forum update shown
+            and the `responses_count` and `comments_count` collapsed in it, from
+            the oldest to the most recent, and the number of forum updates left out.
+    """
+    updates = {event_id: (post_id, object_type) for event_id, post_id, object_type in entries}
+
+    if not max_items or len(updates) <= max_items:
+        items = [
+            {"event_id": event_id, "responses_count": 0, "comments_count": 0}
+            for event_id in updates
+        ]
+        return items, 0
+
+    items = {}
+    for event_id, (post_id, object_type) in updates.items():
+        if object_type == ForumObject.THREAD:
+            items[("post", event_id)] = {
+                "event_id": event_id,
+                "responses_count": 0,
+                "comments_count": 0,
+            }
+            continue
+
+        # The replies of a thread are shown as their most recent reply
+        item = items.pop(("replies", post_id), None) or {
+            "responses_count": 0,
+            "comments_count": 0,
+        }
+        item["event_id"] = event_id
+        if object_type == ForumObject.RESPONSE:
+            item["responses_count"] += 1
+        else:
+            item["comments_count"] += 1
+        items[("replies", post_id)] = item
+
+    items = list(items.values())[-max_items:]
+    for item in items:
+        # A single reply is shown as is
+        if item["responses_count"] + item["comments_count"] == 1:
+            item["responses_count"] = item["comments_count"] = 0
+
+    shown = sum(max(item["responses_count"] + item["comments_count"], 1) for item in items)
+
+    return items, len(updates) - shown
+
+
+def delete_orphan_events() -> int:
+    """
+    Delete the forum events that are no longer referenced by any digest.
+
+    Recent events are kept, since their digest entries may not be created yet
+    and their notifications may not be sent yet.
+
+    Returns:
+        int: The number of deleted events.
+    """
+    has_entries = Exists(ForumNotificationDigestEntry.objects.filter(event=OuterRef("pk")))
+    deleted, _ = (
+        ForumNotificationEvent.objects.filter(created__lte=timezone.now() - ORPHAN_EVENTS_MIN_AGE)
+        .exclude(has_entries)
+        .delete()
+    )
+    log.info(f"Deleted {deleted} forum events already sent in every digest")
+    return deleted
 
 
 def get_subscribers(thread_id):
-    """Return a list of user ids subscribed to a thread."""
-    page = 1
-    num_pages = 100
+    """
+    Return a list of user ids subscribed to a thread.
+
+    Args:
+        thread_id (str): The thread id.
+
+    Returns:
+        set: The ids of the subscribed users.
+    """
+    return set(iter_subscribers(thread_id))
+
+
+def iter_subscribers(thread_id):
+    """
+    Yield the ids of the users subscribed to a thread, page by page.
+
+    Each id is yielded once, as soon as the page containing it is received, so
+    the caller can start processing subscribers while later pages are fetched.
+
+    When FORUM_NOTIFIER_SUBSCRIBERS_CACHE_TIMEOUT is set, the subscribers of the
+    thread are cached for that number of seconds as a packed array of ids. The
+    cache hits and misses are counted, see `get_subscribers_cache_stats`.
+
+    Args:
+        thread_id (str): The thread id.
+
+    Yields:
+        int: The id of a subscribed user.
+    """
+    timeout = getattr(django_settings, "FORUM_NOTIFIER_SUBSCRIBERS_CACHE_TIMEOUT", 0)
+
+    if timeout:
+        cached_subscribers = cache.get(_subscribers_cache_key(thread_id))
+
+        if cached_subscribers is not None:
+            _increment_subscribers_cache_stat("hits")
+            subscribers = array(SUBSCRIBERS_ARRAY_TYPECODE)
+            subscribers.frombytes(cached_subscribers)
+            yield from subscribers
+            return
+
+        _increment_subscribers_cache_stat("misses")
+
     subscribers = set()
 
-    while page < num_pages:
-        url = _url_for_thread_subscriptions(thread_id)
-        params = {"page": page}
-        response = comment_client_utils.perform_request("get", url, params)
+    for page_subscribers in _iter_subscriptions_pages(thread_id):
+        page_subscribers -= subscribers
+        subscribers |= page_subscribers
+        yield from page_subscribers
 
-        for subscription in response["collection"]:
-            subscribers.add(int(subscription["subscriber_id"]))
+    if timeout:
+        cache.set(
+            _subscribers_cache_key(thread_id),
+            array(SUBSCRIBERS_ARRAY_TYPECODE, sorted(subscribers)).tobytes(),
+            timeout,
+        )
 
-        num_pages = response["num_pages"]
-        page = response["page"]
-        page += 1
 
-    return subscribers
+def get_subscribers_cache_stats() -> dict:
+    """
+    Return the hit and miss counters of the thread subscribers cache.
+
+    Returns:
+        dict: The number of cache hits and misses.
+    """
+    return {
+        stat: cache.get(_subscribers_cache_stat_key(stat), 0)
+        for stat in ("hits", "misses")
+    }
+
+
+def _iter_subscriptions_pages(thread_id):
+    """
+    Yield the subscriber ids of each page of the thread subscriptions.
+
+    The first page of subscriptions tells how many pages there are. When
+    FORUM_NOTIFIER_SUBSCRIPTIONS_MAX_WORKERS is greater than 1, the remaining
+    pages are fetched concurrently with up to that number of threads.
+    """
+    url = _url_for_thread_subscriptions(thread_id)
+    response = _get_subscriptions_page(url, 1)
+    yield _get_page_subscribers(response)
+
+    pages = range(response["page"] + 1, response["num_pages"] + 1)
+    max_workers = getattr(django_settings, "FORUM_NOTIFIER_SUBSCRIPTIONS_MAX_WORKERS", 1)
+
+    if max_workers > 1 and len(pages) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pages))) as executor:
+            responses = executor.map(partial(_get_subscriptions_page, url), pages)
+            for page_response in responses:
+                yield _get_page_subscribers(page_response)
+    else:
+        for page in pages:
+            yield _get_page_subscribers(_get_subscriptions_page(url, page))
 
 
 def get_staff_subscribers(course_id):
     """Return a list of course staff users whom configured email preferences."""
-    subscribers = set()
+    return {
+        user_id
+        for user_id, preference in get_course_preferences(course_id).items()
+        if preference == PreferenceOptions.ALL_POSTS
+    }
+
+
+def get_course_preferences(course_id) -> dict:
+    """
+    Return the forum email notification preferences of a course.
+
+    The preferences are cached per course under a version that changes with
+    every preference change, see `invalidate_course_preferences`. The version
+    is read before the preferences are queried, so a reader racing with a
+    change caches what it read under the previous version, which is no
+    longer looked up.
+
+    Args:
+        course_id (str): The course id.
+
+    Returns:
+        dict: The preference of each user keyed by user id.
+    """
+    cache_key = _course_preferences_cache_key(
+        course_id, _get_course_preferences_version(course_id)
+    )
+    preferences = cache.get(cache_key)
+
+    if preferences is None:
+        preferences = dict(
+            ForumNotificationPreference.objects.filter(
+                course_id=course_id
+            ).values_list("user_id", "preference")
+        )
+        cache.set(
+            cache_key,
+            preferences,
+            getattr(django_settings, "FORUM_NOTIFIER_PREFERENCES_CACHE_TIMEOUT", 3600),
+        )
+
+    return preferences
+
+
+def invalidate_course_preferences(course_id):
+    """
+    Invalidate the cached forum email notification preferences of a course.
+
+    A new version is set for the course, so the preferences cached under the
+    previous one are ignored until they expire.
+
+    Args:
+        course_id (str): The course id.
+    """
+    cache.set(_course_preferences_version_cache_key(course_id), uuid4().hex, None)
+
+
+def get_language_preferences(user_ids):
+    """
+    Return the language preference of several users with a single query.
+
+    Args:
+        user_ids (iterable): The user ids.
 
-    preferences = ForumNotificationPreference.objects.filter(
-        course_id=course_id, preference=PreferenceOptions.ALL_POSTS
+    Returns:
+        dict: The language preference keyed by user id. Users without a
+            language preference are not included.
+    """
+    return dict(
+        get_user_preference_model()
+        .objects.filter(user_id__in=list(user_ids), key=LANGUAGE_KEY)
+        .values_list("user_id", "value")
     )
 
-    for preference in preferences:
-        subscribers.add(preference.user.id)
 
-    return subscribers
+def _get_course_preferences_version(course_id):
+    """Return the current version of the cached preferences of a course."""
+    version_key = _course_preferences_version_cache_key(course_id)
+    version = cache.get(version_key)
+
+    if version is None:
+        cache.add(version_key, uuid4().hex, None)
+        version = cache.get(version_key)
+
+    return version
+
+
+def _course_preferences_version_cache_key(course_id):
+    """Return the cache key for the version of the preferences of a course."""
+    return f"forum_email_notifier.preferences_version.{course_id}"
+
+
+def _course_preferences_cache_key(course_id, version):
+    """Return the cache key for the forum email notification preferences of a course."""
+    return f"forum_email_notifier.preferences.{course_id}.{version}"
+
+
+def _subscribers_cache_key(thread_id):
+    """Return the cache key for the subscribers of a thread."""
+    return f"forum_email_notifier.subscribers.{thread_id}"
+
+
+def _subscribers_cache_stat_key(stat):
+    """Return the cache key for a counter of the thread subscribers cache."""
+    return f"forum_email_notifier.subscribers_cache.{stat}"
+
+
+def _increment_subscribers_cache_stat(stat):
+    """Increment a counter of the thread subscribers cache."""
+    set_custom_attribute("forum_email_notifier_subscribers_cache", stat)
+    try:
+        cache.incr(_subscribers_cache_stat_key(stat))
+    except ValueError:
+        cache.set(_subscribers_cache_stat_key(stat), 1, None)
+
+
+def _get_subscriptions_page(url, page):
+    """Return a page of the thread subscriptions from the forum service."""
+    return comment_client_utils.perform_request("get", url, {"page": page})
+
+
+def _get_page_subscribers(response):
+    """Return the subscriber ids of a page of thread subscriptions."""
+    return {
+        int(subscription["subscriber_id"]) for subscription in response["collection"]
+    }
 
 
 def _url_for_thread_subscriptions(thread_id):
@@ -104,3 +589,102 @@ class ForumObject(IntEnum):
     THREAD = 1
     RESPONSE = 2
     COMMENT = 3
+
+
+class TaskBuffer:
+    """
+    A bounded in-process buffer of Celery tasks, enqueued by a background thread.
+
+    Callers never wait for the broker: a task is only added to the buffer, and it
+    is dropped with an error log when the buffer is full. A task that can't be
+    enqueued is logged and doesn't stop the following ones.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        Create an empty buffer. The background thread is started on the first task.
+
+        Args:
+            max_size (int): The maximum number of buffered tasks.
+        """
+        self._queue = Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = Lock()
+
+    def put(self, task, *args, **kwargs) -> bool:
+        """
+        Add a task to the buffer, to be enqueued with `task.delay(*args, **kwargs)`.
+
+        Args:
+            task (Task): The Celery task.
+            *args: The positional arguments of the task.
+            **kwargs: The keyword arguments of the task.
+
+        Returns:
+            bool: Whether the task was added to the buffer.
+        """
+        try:
+            self._queue.put_nowait((task, args, kwargs))
+        except Full:
+            log.error(f"Task buffer is full, {task.name} was not enqueued")
+            set_custom_attribute("forum_notifier_task_buffer_full", True)
+            return False
+
+        self._start_thread()
+        return True
+
+    def drain(self):
+        """
+        Enqueue the buffered tasks in the current thread, e.g. before exiting.
+        """
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                return
+            self._enqueue(*item)
+
+    def join(self):
+        """Wait until every buffered task has been enqueued."""
+        self._queue.join()
+
+    def _start_thread(self):
+        """Start the background thread, unless it is running in this process."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            # The thread is not inherited by forked processes, so it is started again
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="forum-notifier-task-buffer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """Enqueue the buffered tasks as they are added."""
+        while True:
+            self._enqueue(*self._queue.get())
+
+    def _enqueue(self, task, args, kwargs):
+        """Enqueue a buffered task, logging any broker error."""
+        try:
+            task.delay(*args, **kwargs)
+        except Exception:  # pylint: disable=broad-except
+            log.exception(f"Failed to enqueue {task.name}")
+        finally:
+            self._queue.task_done()
+
+
+def get_task_buffer() -> TaskBuffer:
+    """
+    Return the task buffer of this process.
+
+    The buffer holds at most `FORUM_NOTIFIER_TASK_BUFFER_SIZE` tasks.
+    """
+    global _TASK_BUFFER  # pylint: disable=global-statement
+
+    with _TASK_BUFFER_LOCK:
+        if _TASK_BUFFER is None:
+            _TASK_BUFFER = TaskBuffer(getattr(django_settings, "FORUM_NOTIFIER_TASK_BUFFER_SIZE", 1000))
+            atexit.register(_TASK_BUFFER.drain)
+
+    return _TASK_BUFFER
@@ -23,6 +23,10 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': '',
         'PORT': '',
+        # A file database lets concurrency tests write from several threads
+        'TEST': {
+            'NAME': 'test_default.db',
+        },
     }
 }
 
@@ -0,0 +1,77 @@
+"""
+Forum events and digests shared by the test modules.
+"""
+from django.contrib.auth import get_user_model
+
+from platform_plugin_forum_email_notifier.models import (
+    ForumNotificationDigest,
+    ForumNotificationDigestEntry,
+    ForumNotificationEvent,
+    PreferenceOptions,
+)
+from platform_plugin_forum_email_notifier.utils import ForumObject
+
+User = get_user_model()
+
+COURSE_ID = "course-v1:edX+Test+2024"
+
+
+def create_event(**fields):
+    """
+    Create a forum event of a thread, with the given fields overriding the defaults.
+    """
+    return ForumNotificationEvent.objects.create(
+        **{
+            "thread_id": "test-thread-id",
+            "course_id": COURSE_ID,
+            "body": "test-body",
+            "title": "test-title",
+            "url": "https://example.com/",
+            "author_id": "test-author-id",
+            "author_username": "test-username",
+            "author_email": "test@author-email.com",
+            "object_type": ForumObject.THREAD,
+            **fields,
+        }
+    )
+
+
+def create_users(users_count):
+    """
+    Create the users `user-<index>`, each with an email.
+    """
+    return [
+        User.objects.create(username=f"user-{index}", email=f"user-{index}@example.com")
+        for index in range(users_count)
+    ]
+
+
+class DigestTestMixin:
+    """
+    Set up users with a daily digest each, all pending the same forum event.
+    """
+
+    def set_up_digests(self, users_count=3, has_pending=True):
+        """
+        Create the users, their digests, the event and an entry per digest.
+
+        Arguments:
+            users_count (int): The number of users, each with a digest.
+            has_pending (bool): The `has_pending` flag of the digests.
+        """
+        self.course_id = COURSE_ID
+        self.users = create_users(users_count)
+        self.digests = [
+            ForumNotificationDigest.objects.create(
+                user=user,
+                course_id=self.course_id,
+                digest_type=PreferenceOptions.ALL_POSTS_DAILY_DIGEST,
+                has_pending=has_pending,
+            )
+            for user in self.users
+        ]
+        self.event = create_event(course_id=self.course_id)
+        ForumNotificationDigestEntry.objects.bulk_create(
+            ForumNotificationDigestEntry(digest=digest, event=self.event)
+            for digest in self.digests
+        )